@@ -0,0 +1,143 @@
+import contextlib
+import math
+import os
+import threading
+import time
+import zipfile
+
+# Rough cost model of a request, in seconds: reading and writing the packages, rendering each
+# embedded workbook and its chart, and a PowerPoint refresh, which dwarfs the rest
+SECONDS_PER_MB = 0.02
+SECONDS_PER_EMBEDDING = 0.01
+REFRESH_SECONDS = 15.0
+# Weight of the last request in the average service time of a lane
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Saturated(Exception):
+    """Raised when a lane cannot take a request: its queue is full or the request waited too long."""
+
+    def __init__(self, lane, retry_after):
+        super().__init__(f"The {lane} lane is saturated")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+def count_embeddings(ppt_file):
+    """Number of embedded workbooks of a deck (path or seekable file object), read from the ZIP directory only."""
+    try:
+        with zipfile.ZipFile(ppt_file) as ppt_zip:
+            return sum(1 for name in ppt_zip.namelist() if name.startswith('ppt/embeddings/'))
+    except (OSError, zipfile.BadZipFile):
+        return 0  # Not a valid package, the render reports the error
+    finally:
+        if not isinstance(ppt_file, (str, os.PathLike)):
+            ppt_file.seek(0)
+
+
+def estimate_cost(upload_bytes, embeddings, refresh):
+    """Estimated seconds a request takes, from the size of its uploads, its embeddings and whether it refreshes."""
+    cost = upload_bytes / (1024 * 1024) * SECONDS_PER_MB + embeddings * SECONDS_PER_EMBEDDING
+    return cost + REFRESH_SECONDS if refresh else cost
+
+
+class Lane:
+    """
+    Runs at most concurrency requests at once, with at most max_queue more waiting their turn for
+    up to max_wait seconds. Requests beyond that are turned away with Saturated, which carries how
+    long to wait before retrying, estimated from the average service time of the lane.
+    """
+
+    def __init__(self, name, concurrency, max_queue, max_wait, expected_seconds=1.0):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.average_seconds = expected_seconds
+        self.running = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        """Seconds until the work ahead in the lane should be done, at least 1."""
+        backlog = self.running + self.queued + 1
+        return max(1, math.ceil(self.average_seconds * backlog / self.concurrency))
+
+    def acquire(self):
+        with self._condition:
+            # Requests already waiting go first
+            if self.running < self.concurrency and not self.queued:
+                self.running += 1
+                self.admitted += 1
+                return
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise Saturated(self.name, self.retry_after())
+
+            self.queued += 1
+            try:
+                free = self._condition.wait_for(lambda: self.running < self.concurrency, timeout=self.max_wait)
+            finally:
+                self.queued -= 1
+            if not free:
+                self.rejected += 1
+                raise Saturated(self.name, self.retry_after())
+            self.running += 1
+            self.admitted += 1
+
+    def release(self, seconds=None):
+        with self._condition:
+            self.running -= 1
+            if seconds is not None:
+                self.average_seconds += SERVICE_TIME_SMOOTHING * (seconds - self.average_seconds)
+            self._condition.notify_all()  # Every waiter rechecks whether it fits now
+
+    @contextlib.contextmanager
+    def admit(self):
+        """Hold a slot of the lane for the block, waiting in its queue first when it is busy."""
+        self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+
+class AdmissionController:
+    """
+    Sends each request to a lane by estimated cost: refreshes to the refresh lane (PowerPoint runs
+    one at a time), renders costing up to fast_max_cost seconds to the fast lane and the rest to the
+    bulk lane, so cheap renders are not stuck behind slow ones.
+    """
+
+    def __init__(self, fast, bulk, refresh, fast_max_cost):
+        self.lanes = {lane.name: lane for lane in (fast, bulk, refresh)}
+        self.fast = fast
+        self.bulk = bulk
+        self.refresh = refresh
+        self.fast_max_cost = fast_max_cost
+
+    def lane_for(self, cost, refresh):
+        if refresh:
+            return self.refresh
+        return self.fast if cost <= self.fast_max_cost else self.bulk
+
+    def capacity(self):
+        """Requests the lanes can hold at once, running and queued."""
+        return sum(lane.concurrency + lane.max_queue for lane in self.lanes.values())
+
+    def render_metrics(self):
+        """Lane gauges and counters in the Prometheus text exposition format."""
+        lines = []
+        for metric, kind, help_text, attribute in (
+                ("ppt_lane_running", "gauge", "Requests running in each lane.", "running"),
+                ("ppt_lane_queued", "gauge", "Requests waiting in each lane.", "queued"),
+                ("ppt_lane_admitted_total", "counter", "Requests admitted by each lane.", "admitted"),
+                ("ppt_lane_rejected_total", "counter", "Requests turned away by each lane.", "rejected"),
+                ("ppt_lane_average_seconds", "gauge", "Average service time of each lane.", "average_seconds")):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines += [f'{metric}{{lane="{name}"}} {getattr(lane, attribute)}' for name, lane in sorted(self.lanes.items())]
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+import time
+import zipfile
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from openpyxl.utils.exceptions import CellCoordinatesException
+from admission import estimate_cost
+from deck_template import compile_deck_template, file_size, load_deck_template
+from xlsx_reader import read_sheet_dimensions, scan_workbook_markers
+
+
+def _placeholder_problem(sheet_name, cell_ref, dimensions):
+    """Why a placeholder will not show a value ('missing_sheet', 'invalid_cell', 'empty_cell'), or None."""
+    if sheet_name not in dimensions:
+        return "missing_sheet"  # Rendered as "Not found"
+    try:
+        column_letter, row = coordinate_from_string(cell_ref)
+        column = column_index_from_string(column_letter)
+    except (CellCoordinatesException, ValueError):
+        return "invalid_cell"  # Rendered as an empty value
+    dimension = dimensions[sheet_name]
+    if dimension is not None and (row > dimension[0] or column > dimension[1]):
+        return "empty_cell"  # Outside the used range of the sheet, rendered as a space
+    return None
+
+
+def analyze_deck(ppt_file_path, excel_file_path, template_cache_dir=None, refresh=False):
+    """
+    Report how a deck and a workbook fit together without rendering anything: which embedded
+    workbooks match which workbook markers and over which rows, the charts they feed, the
+    placeholders that will not show a value, the workbook markers no embedding uses, and the
+    estimated cost of the render (plus a PowerPoint refresh when refresh is set).
+    Only metadata is read: the ZIP directories, the A1 cell of each embedded workbook, the parts
+    holding placeholders, column A and the <dimension> of each sheet of the workbook.
+    """
+    start = time.perf_counter()
+    if template_cache_dir:
+        template = load_deck_template(ppt_file_path, template_cache_dir)
+    else:
+        template = compile_deck_template(ppt_file_path)
+    with zipfile.ZipFile(ppt_file_path) as ppt_zip:
+        embedded_parts = sorted(name for name in ppt_zip.namelist()
+                                if name.startswith('ppt/embeddings/') and name.endswith('.xlsx'))
+    mapping = scan_workbook_markers(excel_file_path)
+    dimensions = read_sheet_dimensions(excel_file_path)
+    if not dimensions:
+        raise ValueError("the Excel file has no worksheets")
+
+    charts_by_embedding = {}
+    for chart_part, embedded_part in template["charts"].items():
+        charts_by_embedding.setdefault(embedded_part, []).append(chart_part)
+
+    embeddings = []
+    used_markers = set()
+    for part_name in embedded_parts:
+        embedding = template["embeddings"].get(part_name)
+        entry = {"part": part_name, "charts": sorted(charts_by_embedding.get(part_name, []))}
+        if embedding is None:
+            entry["status"] = "no_marker"  # A1 of its active sheet is not a pptstart: marker, left as it is
+        elif embedding["marker"] not in mapping:
+            entry.update(embedding, status="missing_marker")  # Not in the workbook, the chart is skipped
+        else:
+            source = mapping[embedding["marker"]]
+            used_markers.add(embedding["marker"])
+            entry.update(embedding, status="matched", source_sheet=source["sheet_name"],
+                         start_row=source["start_row"], end_row=source["end_row"],
+                         rows=max(source["end_row"] - source["start_row"] + 1, 0))
+        embeddings.append(entry)
+
+    placeholders = 0
+    unresolved = []
+    for part_name, segments in sorted(template["text_parts"].items()):
+        for sheet_name, cell_ref in segments[1::2]:
+            placeholders += 1
+            problem = _placeholder_problem(sheet_name, cell_ref, dimensions)
+            if problem is not None:
+                unresolved.append({"part": part_name, "placeholder": f"[[{sheet_name}!{cell_ref}]]", "problem": problem})
+
+    upload_bytes = file_size(ppt_file_path) + file_size(excel_file_path)
+    rendered = sum(1 for entry in embeddings if entry["status"] == "matched")
+    return {
+        "embeddings": embeddings,
+        "unused_markers": sorted(set(mapping) - used_markers),
+        "placeholders": {"total": placeholders, "unresolved": unresolved},
+        "text_parts": len(template["text_parts"]),
+        "ok": not unresolved and all(entry["status"] != "missing_marker" for entry in embeddings),
+        "estimated_cost": {
+            "seconds": estimate_cost(upload_bytes, rendered, refresh),
+            "upload_bytes": upload_bytes,
+            "embeddings_rendered": rendered,
+        },
+        "analysis_seconds": time.perf_counter() - start,
+    }
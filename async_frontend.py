@@ -0,0 +1,420 @@
+import asyncio
+import io
+import sys
+import tempfile
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from werkzeug import wsgi
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+# Request line and headers larger than this are refused
+MAX_HEADER_BYTES = 64 * 1024
+# Seconds a client may take to send its headers, and to send each chunk of its body
+HEADER_TIMEOUT = 60
+BODY_TIMEOUT = 300
+BODY_CHUNK_SIZE = 256 * 1024
+# Request bodies (and each uploaded file) up to this size stay in memory, larger ones spill to a temporary file
+BODY_SPOOL_BYTES = 32 * 1024 * 1024
+# Larger request bodies are refused with a 413 before they are read, like waitress does
+MAX_BODY_BYTES = 1024 * 1024 * 1024
+# Parts of a multipart body, as werkzeug allows by default
+MAX_FORM_PARTS = 1000
+
+# Key of the environ holding the fields and files of a multipart body, already split by the front end
+FORM_DATA_KEY = "async_frontend.form_data"
+
+REASONS = {400: "Bad Request", 408: "Request Timeout", 413: "Content Too Large", 500: "Internal Server Error"}
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class FileWrapper(wsgi.FileWrapper):
+    """
+    wsgi.file_wrapper: a file response the front end sends with sendfile instead of iterating it.
+    Range responses wrap it and seek it, then it is read in large blocks.
+    """
+
+    def __init__(self, file, buffer_size=BODY_CHUNK_SIZE):
+        super().__init__(file, max(buffer_size, BODY_CHUNK_SIZE))
+
+
+async def _read_head(reader):
+    """Return the request line and the headers of the next request, or None when the client is done."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise BadRequest(400, "Incomplete request head")
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest(400, "Request head too large")
+    except asyncio.TimeoutError:
+        raise BadRequest(408, "Timed out reading the request head")
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise BadRequest(400, "Malformed request line")
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(":")
+        if not separator:
+            raise BadRequest(400, "Malformed header")
+        headers.append((name.strip().lower(), value.strip()))
+    return method, target, version, headers
+
+
+def spooled_buffer(spool_bytes):
+    """Buffer holding up to spool_bytes in memory before it spills to a temporary file."""
+    # SpooledTemporaryFile takes max_size=0 as no limit, a spool_bytes of 0 spills every byte instead
+    return tempfile.SpooledTemporaryFile(max_size=max(spool_bytes, 1), mode='w+b')
+
+
+class _FormReceiver:
+    """
+    Splits a multipart/form-data body into its fields and files as it is received, each file going
+    straight to its own spooled buffer, so an upload is buffered once rather than as the whole body
+    and again per file by the application's parser.
+    """
+
+    def __init__(self, boundary, spool_bytes):
+        self.decoder = MultipartDecoder(boundary, max_parts=MAX_FORM_PARTS)
+        self.spool_bytes = spool_bytes
+        self.fields = []
+        self.files = []
+        self._part = None
+        self._container = None
+        self._file_bytes = 0
+
+    @property
+    def spilled(self):
+        """Whether the file being received went over spool_bytes, so writing it goes to disk."""
+        return isinstance(self._part, File) and self._file_bytes > self.spool_bytes
+
+    def write(self, data):
+        self.decoder.receive_data(data)
+        event = self.decoder.next_event()
+        while not isinstance(event, (Epilogue, NeedData)):
+            if isinstance(event, Field):
+                self._part, self._container = event, []
+            elif isinstance(event, File):
+                self._part = event
+                self._container = spooled_buffer(self.spool_bytes)
+                self._file_bytes = 0
+                self.files.append((event.name, FileStorage(self._container, event.filename, event.name,
+                                                           headers=event.headers)))
+            elif isinstance(event, Data):
+                if isinstance(self._part, Field):
+                    self._container.append(event.data)
+                    if not event.more_data:
+                        self.fields.append((self._part.name, b"".join(self._container).decode('utf-8', 'replace')))
+                else:
+                    self._container.write(event.data)
+                    self._file_bytes += len(event.data)
+                    if not event.more_data:
+                        self._container.seek(0)
+            event = self.decoder.next_event()
+
+    def close(self):
+        for _, file in self.files:
+            file.close()
+
+
+async def _read_body(reader, writer, headers, max_body_bytes=MAX_BODY_BYTES, spool_bytes=BODY_SPOOL_BYTES):
+    """
+    Receive the request body without holding a thread. Returns the body as a rewound spooled file,
+    the _FormReceiver holding its fields and files when it is multipart/form-data (the body is then
+    empty), and its size. Bodies over max_body_bytes are refused before they are read.
+    Once the body (or the file being received) spilled to disk, its writes run in the loop's default
+    executor, not in the application threads, so a slow disk does not stall the other connections.
+    """
+    loop = asyncio.get_running_loop()
+    header_map = dict(headers)
+    chunked = "chunked" in header_map.get("transfer-encoding", "").lower()
+    remaining = 0
+    if not chunked:
+        try:
+            remaining = int(header_map.get("content-length", 0))
+        except ValueError:
+            raise BadRequest(400, "Malformed Content-Length")
+    if max_body_bytes is not None and remaining > max_body_bytes:
+        raise BadRequest(413, f"Request bodies are limited to {max_body_bytes} bytes")
+
+    mimetype, options = parse_options_header(header_map.get("content-type", ""))
+    form = None
+    if mimetype == "multipart/form-data" and options.get("boundary"):
+        form = _FormReceiver(options["boundary"].encode('latin-1'), spool_bytes)
+        body = io.BytesIO()
+        write = form.write
+    else:
+        body = spooled_buffer(spool_bytes)
+        write = body.write
+
+    async def receive(chunk):
+        if (form.spilled if form is not None else received > spool_bytes):
+            await loop.run_in_executor(None, write, chunk)
+        else:
+            write(chunk)
+
+    if header_map.get("expect", "").lower() == "100-continue":
+        writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        await writer.drain()
+
+    received = 0
+    try:
+        if chunked:
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), BODY_TIMEOUT)
+                try:
+                    size = int(size_line.split(b";")[0].strip(), 16)
+                except ValueError:
+                    raise BadRequest(400, "Malformed chunk size")
+                if size == 0:
+                    # Trailers, up to the empty line ending the body
+                    while (await asyncio.wait_for(reader.readline(), BODY_TIMEOUT)).strip():
+                        pass
+                    break
+                if max_body_bytes is not None and received + size > max_body_bytes:
+                    raise BadRequest(413, f"Request bodies are limited to {max_body_bytes} bytes")
+                while size > 0:
+                    chunk = await asyncio.wait_for(reader.read(min(size, BODY_CHUNK_SIZE)), BODY_TIMEOUT)
+                    if not chunk:
+                        raise BadRequest(400, "Incomplete chunked body")
+                    await receive(chunk)
+                    received += len(chunk)
+                    size -= len(chunk)
+                await asyncio.wait_for(reader.readexactly(2), BODY_TIMEOUT)
+        else:
+            while remaining > 0:
+                chunk = await asyncio.wait_for(reader.read(min(remaining, BODY_CHUNK_SIZE)), BODY_TIMEOUT)
+                if not chunk:
+                    raise BadRequest(400, "Incomplete body")
+                await receive(chunk)
+                received += len(chunk)
+                remaining -= len(chunk)
+        if form is not None:
+            await receive(None)
+    except asyncio.TimeoutError:
+        _discard_body(body, form)
+        raise BadRequest(408, "Timed out reading the request body")
+    except RequestEntityTooLarge:
+        _discard_body(body, form)
+        raise BadRequest(413, f"Multipart bodies are limited to {MAX_FORM_PARTS} parts")
+    except ValueError as e:  # Malformed multipart body
+        _discard_body(body, form)
+        raise BadRequest(400, str(e))
+    except BaseException:
+        _discard_body(body, form)
+        raise
+
+    body.seek(0)
+    return body, form, received
+
+
+def _discard_body(body, form):
+    body.close()
+    if form is not None:
+        form.close()
+
+
+def _environ(method, target, version, headers, body, form, body_size, writer, server_port):
+    path, _, query = target.partition("?")
+    peer = writer.get_extra_info("peername") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": urllib.parse.unquote_to_bytes(path).decode('latin-1'),
+        "QUERY_STRING": query,
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": version,
+        "REMOTE_ADDR": peer[0],
+        "REMOTE_PORT": str(peer[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": body,
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "wsgi.file_wrapper": FileWrapper,
+    }
+    if form is not None:
+        environ[FORM_DATA_KEY] = (form.fields, form.files)
+    environ["CONTENT_LENGTH"] = str(body_size)
+    for name, value in headers:
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif name in ("content-length", "transfer-encoding"):
+            continue  # The body handed to the application is complete, its length is known
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_application(app, environ):
+    """Run the application up to its first body chunk, so the status and headers are known."""
+    response = {}
+    written = []
+
+    def start_response(status, response_headers, exc_info=None):
+        if exc_info is not None and response.get("sent"):
+            raise exc_info[1].with_traceback(exc_info[2])
+        response["status"] = status
+        response["headers"] = response_headers
+        return written.append
+
+    result = app(environ, start_response)
+    if isinstance(result, FileWrapper):
+        return response, written, result, None, iter(())
+    iterator = iter(result)
+    first = next(iterator, None)
+    return response, written, result, first, iterator
+
+
+def _head(version, status, headers, keep_alive, chunked):
+    lines = [f"{version} {status}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    if not any(name.lower() == "date" for name, _ in headers):
+        lines.append(f"Date: {formatdate(usegmt=True)}")
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+async def _send_error(writer, status, message):
+    body = message.encode('utf-8')
+    writer.write(_head("HTTP/1.1", f"{status} {REASONS.get(status, '')}",
+                       [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", str(len(body)))], False, False))
+    writer.write(body)
+    await writer.drain()
+
+
+async def _respond(writer, executor, version, keep_alive, method, response, written, result, first, iterator):
+    """Send the response, iterating the application's body in the executor and the socket writes on the loop."""
+    loop = asyncio.get_running_loop()
+    headers = response["headers"]
+    content_length = next((value for name, value in headers if name.lower() == "content-length"), None)
+    # Bodies of unknown length are chunked on HTTP/1.1, on HTTP/1.0 the end of the connection ends them
+    chunked = content_length is None and version == "HTTP/1.1" and method != "HEAD"
+    keep_alive = keep_alive and (content_length is not None or chunked)
+    response["sent"] = True
+    writer.write(_head(version, response["status"], headers, keep_alive, chunked))
+
+    def send(chunk):
+        if chunk:
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk) if chunked else chunk)
+
+    for chunk in written:
+        send(chunk)
+    if isinstance(result, FileWrapper) and method != "HEAD":
+        await writer.drain()
+        # Zero-copy on sockets that support it, asyncio falls back to reading the file otherwise
+        count = int(content_length) if content_length is not None else None
+        await loop.sendfile(writer.transport, result.file, offset=result.file.tell(), count=count)
+    elif first is not None:
+        send(first)
+        await writer.drain()
+        while True:
+            chunk = await loop.run_in_executor(executor, next, iterator, None)
+            if chunk is None:
+                break
+            send(chunk)
+            await writer.drain()
+    if chunked:
+        writer.write(b"0\r\n\r\n")
+    await writer.drain()
+    return keep_alive
+
+
+async def _serve_connection(reader, writer, app, executor, server_port, max_body_bytes, spool_bytes):
+    loop = asyncio.get_running_loop()
+    try:
+        keep_alive = True
+        while keep_alive:
+            try:
+                request_head = await _read_head(reader)
+                if request_head is None:
+                    break
+                method, target, version, headers = request_head
+                body, form, body_size = await _read_body(reader, writer, headers, max_body_bytes, spool_bytes)
+            except BadRequest as e:
+                await _send_error(writer, e.status, str(e))
+                break
+
+            connection = dict(headers).get("connection", "").lower()
+            keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+            environ = _environ(method, target, version, headers, body, form, body_size, writer, server_port)
+            result = None
+            try:
+                # The application only gets a thread once its input is complete
+                try:
+                    response, written, result, first, iterator = await loop.run_in_executor(
+                        executor, _call_application, app, environ)
+                except Exception as e:
+                    print(f"Application error: {e}")
+                    await _send_error(writer, 500, "Internal Server Error")
+                    break
+                try:
+                    keep_alive = await _respond(writer, executor, version, keep_alive, method,
+                                                response, written, result, first, iterator)
+                except ConnectionError:
+                    raise
+                except Exception as e:
+                    # The head is already sent, closing the connection tells the client the body is incomplete
+                    print(f"Application error while sending the response: {e}")
+                    traceback.print_exc()
+                    break
+            finally:
+                if result is not None and hasattr(result, "close"):
+                    await loop.run_in_executor(executor, result.close)
+                _discard_body(body, form)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass  # The client went away
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def _serve(app, host, port, threads, max_body_bytes, spool_bytes):
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+    server = await asyncio.start_server(
+        lambda reader, writer: _serve_connection(reader, writer, app, executor, port, max_body_bytes, spool_bytes),
+        host, port, limit=MAX_HEADER_BYTES)
+    print(f"Serving on http://{host}:{port} (asyncio front end, {threads} application threads)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def serve(app, host='0.0.0.0', port=8000, threads=4, max_body_bytes=MAX_BODY_BYTES, spool_bytes=BODY_SPOOL_BYTES):
+    """
+    Serve a WSGI application from an asyncio event loop. Request bodies are received and responses
+    sent by the loop, so slow clients hold a connection but no thread. The application runs in a pool of
+    threads only once the request body is complete, and file responses (wsgi.file_wrapper, e.g.
+    send_file) are sent with sendfile. The number of open connections is not bound by threads.
+    Bodies larger than max_body_bytes (None for no limit) are refused with a 413. Bodies are held in
+    memory up to spool_bytes; multipart bodies are split into their files as they arrive, which the
+    application finds under FORM_DATA_KEY in the environ (see server.SpooledRequest).
+    """
+    asyncio.run(_serve(app, host, port, threads, max_body_bytes, spool_bytes))
@@ -0,0 +1,102 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from pipeline import render_batch
+
+# Name of the entry listing the result of every deck, written last in the batch ZIP
+REPORT_NAME = "batch_report.json"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Unseekable sink collecting what zipfile writes, so the archive can be sent while it is built."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_batch_zip(ppt_file_paths, excel_file_path, output_dir, template_cache_dir, workers=1, refresh=None,
+                     workbook_cache=None):
+    """
+    Render several decks from one workbook (see render_batch) and yield the bytes of a ZIP holding
+    each updated deck as soon as it is finished, followed by batch_report.json with the status of
+    every deck. refresh, when given, is called with each rendered deck and returns an error
+    message or None (see refresh_deck). The workbook is loaded before anything is yielded, so
+    a workbook that cannot be read raises right away instead of giving a broken archive.
+    """
+    timings, results = render_batch(ppt_file_paths, excel_file_path, output_dir, template_cache_dir, workers,
+                                    workbook_cache)
+    return _zip_results(timings, results, refresh)
+
+
+def _zip_results(timings, results, refresh):
+    batch_start = time.perf_counter()
+    buffer = _ChunkBuffer()
+    report = {"timings": timings, "decks": []}
+    # Decks are already compressed packages, they are stored as they are
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as batch_zip:
+        for result in results:
+            deck = {"deck": os.path.basename(result["ppt_file_path"]), "error": result.get("error")}
+            if deck["error"] is None:
+                deck["refresh_error"] = refresh(result["output_ppt_file"]) if refresh is not None else None
+                deck["filename"] = os.path.basename(result["output_ppt_file"])
+                deck["stats"] = result["stats"]
+                with open(result["output_ppt_file"], 'rb') as output_file, \
+                        batch_zip.open(deck["filename"], 'w', force_zip64=True) as entry:
+                    for chunk in iter(lambda: output_file.read(COPY_CHUNK_SIZE), b''):
+                        entry.write(chunk)
+                        yield buffer.take()
+            report["decks"].append(deck)
+            yield buffer.take()
+
+        report["timings"]["total"] = time.perf_counter() - batch_start
+        batch_zip.writestr(REPORT_NAME, json.dumps(report, indent=2))
+    yield buffer.take()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Update several decks from one Excel workbook into a ZIP of results.")
+    parser.add_argument("excel_file", help="Excel workbook (.xlsx) with the pptstart:/pptend: markers")
+    parser.add_argument("ppt_files", nargs="+", help="decks to update (.pptx, .pptm)")
+    parser.add_argument("-o", "--output", default="batch_results.zip", help="ZIP file to write (default: batch_results.zip)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="decks rendered in parallel")
+    parser.add_argument("--template-cache", default=os.path.join(os.getcwd(), 'template_cache'),
+                        help="directory of the compiled deck templates")
+    args = parser.parse_args()
+
+    output_dir = tempfile.mkdtemp(prefix='powerpoint_batch_')
+    try:
+        with open(args.output, 'wb') as output_file:
+            for chunk in stream_batch_zip(args.ppt_files, args.excel_file, output_dir, args.template_cache, args.workers):
+                output_file.write(chunk)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    with zipfile.ZipFile(args.output) as batch_zip:
+        report = json.loads(batch_zip.read(REPORT_NAME))
+    failed = [deck for deck in report["decks"] if deck["error"]]
+    for deck in failed:
+        print(f"{deck['deck']}: {deck['error']}")
+    print(f"Wrote {args.output}: {len(report['decks']) - len(failed)} decks updated, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,252 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+import zlib
+from openpyxl import Workbook
+from pptx import Presentation
+from pptx.chart.data import CategoryChartData
+from pptx.enum.chart import XL_CHART_TYPE
+from pptx.util import Inches
+from pipeline import render_deck
+from ppt_workbook_update import (analyze_excel_markers, build_sheet_index, modify_embedded_excel_in_pptx,
+                                 process_embedded_workbook, replace_placeholders_in_slide_content)
+from workbook_snapshot import load_workbook_snapshot
+from xlsx_writer import write_xlsx
+
+# Number formats cycled over the placeholder cells, with a value of the matching type
+PLACEHOLDER_FORMATS = [
+    ("#,##0", lambda rng: rng.randint(1_000, 999_999)),
+    ("0.0%", lambda rng: rng.random()),
+    ("0.00", lambda rng: rng.uniform(-1_000, 1_000)),
+    ("General", lambda rng: rng.uniform(0, 100)),
+    ("yyyy-mm-dd", lambda rng: datetime.datetime(2024, 1, 1) + datetime.timedelta(days=rng.randint(0, 365))),
+]
+
+
+def _noise_png(width, height, rng):
+    """Return a PNG of random pixels, which does not compress, to stand for large photos in a deck."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 1))
+            + chunk(b"IEND", b""))
+
+
+def _chart_rows(chart_index, rows, cols, rng):
+    """Rows of the marker block of a chart: the marker and series names, then one row per category."""
+    table = [[f"pptstart:chart{chart_index}"] + [f"Series {col}" for col in range(1, cols)]]
+    table += [[f"Category {row}"] + [round(rng.uniform(0, 1000), 2) for _ in range(1, cols)] for row in range(1, rows + 1)]
+    return table
+
+
+def generate_deck(path, slides, charts, placeholders, rows, cols, media_mb=0, seed=0):
+    """
+    Write a synthetic deck: slides slides holding charts charts (embedded workbooks whose A1 is a
+    pptstart: marker) and placeholders [[Data!Bn]] placeholders, spread over the slides, and
+    optionally a random picture of media_mb megabytes.
+    """
+    rng = random.Random(seed)
+    prs = Presentation()
+    layout = prs.slide_layouts[6]
+    slide_list = [prs.slides.add_slide(layout) for _ in range(slides)]
+
+    for chart_index in range(charts):
+        chart_data = CategoryChartData()
+        chart_data.categories = [f"Category {row}" for row in range(1, rows + 1)]
+        for col in range(1, cols):
+            chart_data.add_series(f"Series {col}", [0] * rows)
+        slide_list[chart_index % slides].shapes.add_chart(
+            XL_CHART_TYPE.COLUMN_CLUSTERED, Inches(0.5), Inches(1.5), Inches(6), Inches(4), chart_data)
+
+    for slide_index, slide in enumerate(slide_list):
+        cells = range(slide_index, placeholders, slides)
+        if len(cells):
+            text_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.2), Inches(9), Inches(1))
+            text_box.text_frame.text = " ".join(f"KPI {cell}: [[Data!B{cell + 2}]]" for cell in cells)
+
+    if media_mb:
+        width = 1024
+        height = max(1, int(media_mb * 1024 * 1024 / (width * 3)))
+        slide_list[0].shapes.add_picture(io.BytesIO(_noise_png(width, height, rng)), Inches(7), Inches(5), Inches(2))
+
+    deck = io.BytesIO()
+    prs.save(deck)
+
+    # Put the markers in the embedded workbooks, in chart order
+    with zipfile.ZipFile(deck) as source, zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as target:
+        embeddings = sorted((item.filename for item in source.infolist() if item.filename.startswith('ppt/embeddings/')),
+                            key=lambda name: int(''.join(filter(str.isdigit, name)) or 0))
+        markers = {name: index for index, name in enumerate(embeddings)}
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename in markers:
+                content = write_xlsx("Sheet1", _chart_rows(markers[item.filename], rows, cols, rng))
+            target.writestr(item, content)
+
+
+def generate_workbook(path, charts, placeholders, rows, cols, seed=0):
+    """
+    Write the workbook matching generate_deck: the Data sheet holds the placeholder cells in
+    column B, the Charts sheet one pptstart:/pptend: block of rows x cols per chart.
+    """
+    rng = random.Random(seed + 1)
+    workbook = Workbook()
+    data = workbook.active
+    data.title = "Data"
+    data.append(["Name", "Value"])
+    for cell in range(placeholders):
+        number_format, make_value = PLACEHOLDER_FORMATS[cell % len(PLACEHOLDER_FORMATS)]
+        data.append([f"KPI {cell}", make_value(rng)])
+        data.cell(row=cell + 2, column=2).number_format = number_format
+
+    chart_sheet = workbook.create_sheet("Charts")
+    for chart_index in range(charts):
+        for row in _chart_rows(chart_index, rows, cols, rng):
+            chart_sheet.append(row)
+        chart_sheet.append(["pptend:"])
+    workbook.save(path)
+
+
+def measure(function, repeat):
+    """Time function over repeat runs, then run it once more under tracemalloc for its peak memory."""
+    durations = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        "seconds_min": min(durations),
+        "seconds_median": statistics.median(durations),
+        "peak_memory_bytes": peak,
+    }
+
+
+def run_benchmarks(params, work_dir, repeat):
+    """Generate the inputs for params in work_dir and measure each pipeline stage on them."""
+    ppt_file_path = os.path.join(work_dir, "deck.pptx")
+    excel_file_path = os.path.join(work_dir, "workbook.xlsx")
+    generate_deck(ppt_file_path, params["slides"], params["charts"], params["placeholders"],
+                  params["rows"], params["cols"], params["media_mb"], params["seed"])
+    generate_workbook(excel_file_path, params["charts"], params["placeholders"], params["rows"], params["cols"], params["seed"])
+
+    workbook = load_workbook_snapshot(excel_file_path)
+    mapping = analyze_excel_markers(workbook)
+    sheets = build_sheet_index(workbook)
+    with zipfile.ZipFile(ppt_file_path) as ppt_zip:
+        embeddings = [(name, ppt_zip.read(name)) for name in ppt_zip.namelist() if name.startswith('ppt/embeddings/')]
+        slides = [ppt_zip.read(name) for name in ppt_zip.namelist()
+                  if name.startswith('ppt/slides/') and name.endswith('.xml')]
+
+    config = {'ppt_file_path': ppt_file_path, 'workbook': workbook, 'mapping': mapping}
+    output_ppt_file = os.path.join(work_dir, "deck_updated.pptx")
+    template_cache_dir = os.path.join(work_dir, "template_cache")
+
+    cases = {
+        "load_workbook_snapshot": lambda: load_workbook_snapshot(excel_file_path),
+        "analyze_excel_markers": lambda: analyze_excel_markers(workbook),
+        "process_embedded_workbook": lambda: [process_embedded_workbook(name, content, workbook, mapping)
+                                              for name, content in embeddings],
+        "replace_placeholders_in_slide_content": lambda: [replace_placeholders_in_slide_content(content, workbook, sheets)
+                                                          for content in slides],
+        "modify_embedded_excel_in_pptx": lambda: modify_embedded_excel_in_pptx(config),
+        "render_deck": lambda: render_deck(ppt_file_path, excel_file_path, output_ppt_file, template_cache_dir),
+    }
+
+    return {
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "input_bytes": {"deck": os.path.getsize(ppt_file_path), "workbook": os.path.getsize(excel_file_path)},
+        "cases": {name: measure(function, repeat) for name, function in cases.items()},
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of each case against a baseline run and return the names of the regressed cases."""
+    if baseline.get("params") != results["params"]:
+        print("Warning: the baseline was run with other parameters", file=sys.stderr)
+
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            print(f"{name:40} new", file=sys.stderr)
+            continue
+        time_ratio = case["seconds_median"] / base["seconds_median"] if base["seconds_median"] else float("inf")
+        memory_ratio = case["peak_memory_bytes"] / base["peak_memory_bytes"] if base["peak_memory_bytes"] else float("inf")
+        regressed = time_ratio > 1 + threshold or memory_ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:40} time x{time_ratio:.2f}  memory x{memory_ratio:.2f}{'  REGRESSION' if regressed else ''}",
+              file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the deck update pipeline on synthetic decks and workbooks.")
+    parser.add_argument("--slides", type=int, default=20)
+    parser.add_argument("--charts", type=int, default=20, help="charts with an embedded workbook")
+    parser.add_argument("--placeholders", type=int, default=200, help="[[Data!Bn]] placeholders over all slides")
+    parser.add_argument("--rows", type=int, default=12, help="categories of each chart")
+    parser.add_argument("--cols", type=int, default=4, help="columns of each chart table, the category column included")
+    parser.add_argument("--media-mb", type=float, default=0, help="size of a random picture added to the deck")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of each case")
+    parser.add_argument("--output", help="write the results JSON to this file instead of stdout")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="slowdown or memory growth over the baseline reported as a regression (default 0.1)")
+    parser.add_argument("--keep", help="generate the inputs in this directory and keep them")
+    args = parser.parse_args()
+
+    params = {key: getattr(args, key) for key in ("slides", "charts", "placeholders", "rows", "cols", "media_mb", "seed")}
+    work_dir = args.keep or tempfile.mkdtemp(prefix='powerpoint_benchmark_')
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(params, work_dir, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 1 if compare(results, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from ppt_workbook_update import TEXT_PART_PATTERN, find_chart_embeddings, read_embedded_marker, split_placeholders
+
+# Bump when the layout of compiled templates changes so stale cache entries are recompiled
+TEMPLATE_VERSION = 2
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Compiled templates hold the XML of the parts with placeholders, entries are evicted least
+# recently used first once the cache directory grows past this size
+TEMPLATE_CACHE_MAX_BYTES = int(os.environ.get('PPT_TEMPLATE_CACHE_MB', 256)) * 1024 * 1024
+
+
+def hash_file(file):
+    """Return the SHA-256 hex digest of a file given by path or binary file object."""
+    digest = hashlib.sha256()
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    else:
+        file.seek(0)
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        file.seek(0)
+    return digest.hexdigest()
+
+
+def file_size(file):
+    """Size of a file given by path or seekable binary file object."""
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.getsize(file)
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size
+
+
+def compile_deck_template(ppt_file_path, deck_hash=None):
+    """
+    Compile a deck into a template: the marker of each embedded workbook, the embedded workbook
+    feeding each chart, and every slide, notes, layout, master or chart part holding placeholders
+    split into literal segments and [sheet name, cell reference] slots (see split_placeholders).
+    """
+    template = {
+        "version": TEMPLATE_VERSION,
+        "deck_hash": deck_hash or hash_file(ppt_file_path),
+        "embeddings": {},
+        "charts": {},
+        "text_parts": {},
+    }
+
+    with zipfile.ZipFile(ppt_file_path, 'r') as ppt_zip:
+        for item in ppt_zip.infolist():
+            if item.filename.startswith('ppt/embeddings/') and item.filename.endswith('.xlsx'):
+                try:
+                    marker = read_embedded_marker(item.filename, ppt_zip.read(item.filename))
+                except Exception as e:
+                    print(f"Failed to read the marker of '{item.filename}': {e}")
+                    marker = None
+                if marker is not None:
+                    embedded_sheet_name, marker_name = marker
+                    template["embeddings"][item.filename] = {"sheet_name": embedded_sheet_name, "marker": marker_name}
+            elif TEXT_PART_PATTERN.match(item.filename):
+                segments = split_placeholders(ppt_zip.read(item.filename))
+                if len(segments) > 1:
+                    template["text_parts"][item.filename] = segments
+
+        template["charts"] = {chart_part: embedded_part
+                              for chart_part, embedded_part in find_chart_embeddings(ppt_zip).items()
+                              if embedded_part in template["embeddings"]}
+
+    return template
+
+
+def template_references(templates):
+    """
+    Return what compiled templates read from the workbook: the markers of their embedded workbooks
+    and the cells shown by their placeholders, as {"markers": [...], "cells": {sheet name: [cell references]}}.
+    """
+    markers = set()
+    cells = {}
+    for template in templates:
+        markers.update(embedding["marker"] for embedding in template["embeddings"].values())
+        for segments in template["text_parts"].values():
+            for sheet_name, cell_ref in segments[1::2]:  # Literals and slots alternate, starting with a literal
+                cells.setdefault(sheet_name, set()).add(cell_ref)
+    return {"markers": sorted(markers), "cells": {sheet_name: sorted(cell_refs) for sheet_name, cell_refs in sorted(cells.items())}}
+
+
+def evict_deck_templates(cache_dir, max_bytes):
+    """Remove the least recently used compiled templates of cache_dir until it holds at most max_bytes."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.json'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue  # Evicted by a concurrent request
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def load_deck_template(ppt_file_path, cache_dir, max_bytes=TEMPLATE_CACHE_MAX_BYTES, deck_hash=None):
+    """
+    Return the compiled template of a deck, from the on-disk cache when the same deck content
+    was compiled before, otherwise compiling it and storing it in the cache, which is kept
+    under max_bytes by evicting the least recently used templates.
+    deck_hash is the hash_file digest of the deck when the caller already has it.
+    """
+    deck_hash = deck_hash or hash_file(ppt_file_path)
+    cache_path = os.path.join(cache_dir, f"{deck_hash}.json")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                template = json.load(f)
+            if template.get("version") == TEMPLATE_VERSION:
+                os.utime(cache_path)  # Mark the entry as recently used
+                return template
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable template cache entry '{cache_path}': {e}")
+
+    template = compile_deck_template(ppt_file_path, deck_hash)
+
+    # Write to a temporary file first so concurrent requests never read a partial entry
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(template, f)
+    os.replace(temp_path, cache_path)
+    evict_deck_templates(cache_dir, max_bytes)
+
+    return template
@@ -0,0 +1,161 @@
+import contextlib
+import contextvars
+import threading
+import time
+
+# Upper bounds (seconds) of the duration histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Trace of the request or render running in the current thread, None when nothing is collected
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """Duration, bytes and item count of each stage of one request or render."""
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds, bytes=0, count=1):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "bytes": 0, "count": 0})
+        stage["seconds"] += seconds
+        stage["bytes"] += bytes
+        stage["count"] += count
+
+    def merge(self, stages):
+        """Add the stages of another trace, e.g. the 'stages' of a render run in a worker process."""
+        for name, stage in stages.items():
+            self.add(name, stage["seconds"], stage["bytes"], stage["count"])
+
+    def server_timing(self):
+        """Value of a Server-Timing header listing every stage."""
+        return ", ".join(f'{name};dur={stage["seconds"] * 1000:.1f};desc="{stage["count"]} x, {stage["bytes"]} bytes"'
+                         for name, stage in self.stages.items())
+
+
+class _Stage:
+    """Handle of a running stage, bytes and count can be set before it ends."""
+    __slots__ = ("bytes", "count")
+
+    def __init__(self, bytes, count):
+        self.bytes = bytes
+        self.count = count
+
+
+@contextlib.contextmanager
+def collect():
+    """Collect the stages run in this block into a new Trace, separate from any enclosing one."""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def start(trace):
+    """Make trace the current one until finish(token) is called (for request hooks)."""
+    return _current_trace.set(trace)
+
+
+def finish(token):
+    _current_trace.reset(token)
+
+
+@contextlib.contextmanager
+def stage(name, bytes=0, count=1):
+    """Time the block as a stage of the current trace, if any."""
+    handle = _Stage(bytes, count)
+    start_time = time.perf_counter()
+    try:
+        yield handle
+    finally:
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, time.perf_counter() - start_time, handle.bytes, handle.count)
+
+
+def merge(stages):
+    """Add the stages of a trace collected elsewhere (e.g. returned by a worker process) to the current trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.merge(stages)
+
+
+def record(name, seconds, bytes=0, count=1):
+    """Add an already measured stage to the current trace, if any."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds, bytes, count)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Prometheus metrics of the process: a histogram of the duration of each stage per request,
+    the bytes and items handled by each stage, and a histogram of request durations.
+    """
+
+    def __init__(self):
+        self._stage_seconds = {}
+        self._stage_bytes = {}
+        self._stage_items = {}
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def observe_stages(self, stages):
+        with self._lock:
+            for name, stage in stages.items():
+                self._stage_seconds.setdefault(name, _Histogram()).observe(stage["seconds"])
+                self._stage_bytes[name] = self._stage_bytes.get(name, 0) + stage["bytes"]
+                self._stage_items[name] = self._stage_items.get(name, 0) + stage["count"]
+
+    def observe_request(self, endpoint, status, seconds):
+        with self._lock:
+            self._requests.setdefault((endpoint, str(status)), _Histogram()).observe(seconds)
+
+    def render(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            self._render_histograms(lines, "ppt_stage_duration_seconds", "Duration of each stage per request or render.",
+                                    {(("stage", name),): histogram for name, histogram in self._stage_seconds.items()})
+            lines.append("# HELP ppt_stage_bytes_total Bytes handled by each stage.")
+            lines.append("# TYPE ppt_stage_bytes_total counter")
+            lines += [f'ppt_stage_bytes_total{{stage="{name}"}} {value}' for name, value in sorted(self._stage_bytes.items())]
+            lines.append("# HELP ppt_stage_items_total Items (parts, files, charts...) handled by each stage.")
+            lines.append("# TYPE ppt_stage_items_total counter")
+            lines += [f'ppt_stage_items_total{{stage="{name}"}} {value}' for name, value in sorted(self._stage_items.items())]
+            self._render_histograms(lines, "ppt_request_duration_seconds", "Duration of the HTTP requests.",
+                                    {(("endpoint", endpoint), ("status", status)): histogram
+                                     for (endpoint, status), histogram in self._requests.items()})
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, metric, help_text, histograms):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, histogram in sorted(histograms.items()):
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            for bound, count in zip(DURATION_BUCKETS, histogram.buckets):
+                lines.append(f'{metric}_bucket{{{label_text},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{label_text},le="+Inf"}} {histogram.count}')
+            lines.append(f"{metric}_sum{{{label_text}}} {histogram.sum}")
+            lines.append(f"{metric}_count{{{label_text}}} {histogram.count}")
+
+
+# Metrics of this process, served by /metrics
+metrics = MetricsRegistry()
@@ -0,0 +1,164 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import instrumentation
+from pipeline import render_deck, refresh_deck
+from ppt_workbook_update import discard_process_pool, shared_process_pool
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue already holds max_pending jobs."""
+
+
+def _timed_render(submitted_at, *args, **kwargs):
+    """Run render_deck in a worker process and add the time the job waited for a worker."""
+    queue_wait = time.time() - submitted_at
+    stats = render_deck(*args, **kwargs)
+    stats["timings"] = {"queue_wait": queue_wait, **stats["timings"]}
+    return stats
+
+
+class JobManager:
+    """
+    Runs deck updates in the background.
+    Renders go to the shared pool of worker processes (see shared_process_pool), PowerPoint
+    refreshes (the refresh callable) to a single-slot queue since only one PowerPoint instance can run at a time. At most max_pending
+    jobs can be unfinished, submitting more raises QueueFull. workbook_cache, when given, is the
+    WorkbookCache the workers load workbooks through.
+    """
+
+    def __init__(self, workers=2, max_pending=20, refresh=refresh_deck, workbook_cache=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.refresh = refresh
+        self.workbook_cache = workbook_cache
+        self._refresh_pool = ThreadPoolExecutor(max_workers=1)
+        self._jobs = {}
+        self._futures = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, ppt_file_path, excel_file_path, output_ppt_file, template_cache_dir, refresh=False, temp_dir=None):
+        """Queue a deck update and return its job id."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} jobs are already waiting")
+            self._pending += 1
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "created": time.time(),
+                "finished": None,
+                "refresh": refresh,
+                "output_ppt_file": output_ppt_file,
+                "temp_dir": temp_dir,
+                "timings": {},
+                "stats": None,
+                "error": None,
+                "refresh_error": None,
+            }
+
+        render_args = (_timed_render, time.time(), ppt_file_path, excel_file_path, output_ppt_file, template_cache_dir)
+        try:
+            pool = shared_process_pool(self.workers)
+            try:
+                future = pool.submit(*render_args, workbook_cache=self.workbook_cache)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory), start a new pool instead of failing every job
+                discard_process_pool(pool)
+                future = shared_process_pool(self.workers).submit(*render_args, workbook_cache=self.workbook_cache)
+        except BaseException:
+            # The job never reached the pool, give its queue slot back
+            with self._lock:
+                self._pending -= 1
+                del self._jobs[job_id]
+            raise
+        self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._rendered(job_id, f))
+        return job_id
+
+    def _rendered(self, job_id, future):
+        job = self._jobs[job_id]
+        self._futures.pop(job_id, None)
+        try:
+            stats = future.result()
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._finish(job_id, "failed", error=str(e))
+            return
+
+        job["stats"] = {key: value for key, value in stats.items() if key != "timings"}
+        job["timings"].update(stats["timings"])
+        instrumentation.metrics.observe_stages(stats["stages"])
+        if not job["refresh"]:
+            self._finish(job_id, "done")
+            return
+
+        job["status"] = "waiting_for_powerpoint"
+        refresh_queued_at = time.time()
+
+        def run_refresh():
+            job["status"] = "refreshing"
+            job["timings"]["refresh_wait"] = time.time() - refresh_queued_at
+            refresh_start = time.perf_counter()
+            status, error = "failed", "The refresh did not complete"
+            try:
+                with instrumentation.collect() as trace:
+                    job["refresh_error"] = self.refresh(job["output_ppt_file"])
+                job["timings"]["refresh"] = time.perf_counter() - refresh_start
+                instrumentation.metrics.observe_stages(trace.stages)
+                status, error = "done", None
+            except Exception as e:
+                print(f"Job {job_id} refresh failed: {e}")
+                error = str(e)
+            finally:
+                self._finish(job_id, status, error=error)
+
+        try:
+            self._refresh_pool.submit(run_refresh)
+        except RuntimeError as e:  # Shut down
+            self._finish(job_id, "failed", error=str(e))
+
+    def _finish(self, job_id, status, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["error"] = error
+            job["finished"] = time.time()
+            job["timings"]["total"] = job["finished"] - job["created"]
+            self._pending -= 1
+
+    def get(self, job_id):
+        """Return a copy of the job record, or None for an unknown job id."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job, timings=dict(job["timings"]))
+            future = self._futures.get(job_id)
+            if job["status"] == "queued" and future is not None and future.running():
+                job["status"] = "rendering"
+            return job
+
+    def active_dirs(self):
+        """Temporary directories of the jobs that are not finished yet."""
+        with self._lock:
+            return {job["temp_dir"] for job in self._jobs.values() if job["finished"] is None and job["temp_dir"]}
+
+    def prune(self, max_age):
+        """Forget jobs finished more than max_age seconds ago."""
+        now = time.time()
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job["finished"] is not None and now - job["finished"] > max_age]:
+                del self._jobs[job_id]
+
+    def shutdown(self):
+        # The render pool is shared, only the renders of this manager that have not started are dropped
+        for future in list(self._futures.values()):
+            future.cancel()
+        self._refresh_pool.shutdown(wait=False, cancel_futures=True)
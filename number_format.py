@@ -0,0 +1,474 @@
+import datetime
+import functools
+import math
+import numbers
+from decimal import Decimal, ROUND_HALF_UP
+from openpyxl.utils.datetime import from_excel, to_excel
+
+# Number of distinct number formats kept compiled
+FORMAT_CACHE_SIZE = 1024
+
+# Excel General shows at most this many characters for a number
+GENERAL_WIDTH = 11
+
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December"]
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+DATE_TOKENS = {"year", "month_or_minute", "day", "hour", "second", "ampm", "elapsed"}
+
+# Color codes, [Red] or [Color1] to [Color56], only change how the text is shown
+COLOR_NAMES = {"black", "blue", "cyan", "green", "magenta", "red", "white", "yellow"}
+
+
+def format_general(value):
+    """Format a value like the General number format of Excel."""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, numbers.Integral) and abs(value) < 10 ** GENERAL_WIDTH:
+        return str(value)
+    if isinstance(value, numbers.Real) and math.isfinite(value):
+        value = float(value)
+        if value == 0:
+            return "0"
+        if 1e-9 <= abs(value) < 10 ** GENERAL_WIDTH:
+            for precision in range(GENERAL_WIDTH - 1, 0, -1):
+                text = f"{value:.{precision}g}"
+                if "e" not in text and len(text.lstrip("-")) <= GENERAL_WIDTH:
+                    return text
+        mantissa, exponent = f"{value:.5E}".split("E")
+        mantissa = mantissa.rstrip("0").rstrip(".")
+        return f"{mantissa}E{exponent[0]}{exponent[1:].zfill(2)}"
+    return str(value)
+
+
+def _split_sections(number_format):
+    """Split a format into its sections (positive;negative;zero;text), ignoring quoted semicolons."""
+    sections = [""]
+    quoted = False
+    bracket = False
+    index = 0
+    while index < len(number_format):
+        char = number_format[index]
+        if char == "\\" and not quoted and index + 1 < len(number_format):
+            sections[-1] += number_format[index:index + 2]
+            index += 2
+            continue
+        if char == '"' and not bracket:
+            quoted = not quoted
+        elif char == "[" and not quoted:
+            bracket = True
+        elif char == "]" and not quoted:
+            bracket = False
+        elif char == ";" and not quoted and not bracket:
+            sections.append("")
+            index += 1
+            continue
+        sections[-1] += char
+        index += 1
+    return sections
+
+
+def _parse_condition(text):
+    """Return (operator, threshold) for a [>=100] style condition, or None if text is not a condition."""
+    for operator in ("<=", ">=", "<>", "<", ">", "="):
+        if text.startswith(operator):
+            try:
+                threshold = float(text[len(operator):])
+            except ValueError:
+                return None
+            return operator, threshold
+    return None
+
+
+def _check_condition(condition, value):
+    operator, threshold = condition
+    return {
+        "<=": value <= threshold,
+        ">=": value >= threshold,
+        "<>": value != threshold,
+        "<": value < threshold,
+        ">": value > threshold,
+        "=": value == threshold,
+    }[operator]
+
+
+def _tokenize(section):
+    """
+    Split a format section into (kind, text) tokens and return them with its condition.
+    Literal text, color codes, locale codes and padding are resolved here.
+    """
+    tokens = []
+    condition = None
+    index = 0
+    length = len(section)
+    while index < length:
+        char = section[index]
+        lower = section[index:].lower()
+        if char == '"':
+            end = section.find('"', index + 1)
+            end = length if end == -1 else end
+            tokens.append(("literal", section[index + 1:end]))
+            index = end + 1
+        elif char == "\\":
+            tokens.append(("literal", section[index + 1:index + 2]))
+            index += 2
+        elif char == "_":
+            tokens.append(("literal", " "))  # Space as wide as the next character
+            index += 2
+        elif char == "*":
+            index += 2  # Fill character repeated to the column width
+        elif char == "[":
+            end = section.find("]", index)
+            end = length if end == -1 else end
+            content = section[index + 1:end]
+            if content.startswith("$"):
+                tokens.append(("literal", content[1:].split("-")[0]))  # Currency symbol and locale
+            elif content.lower() in ("h", "hh", "m", "mm", "s", "ss"):
+                tokens.append(("elapsed", content.lower()))
+            elif _parse_condition(content) is not None:
+                condition = _parse_condition(content)
+            elif content.lower() not in COLOR_NAMES and not (content.lower().startswith("color") and content[5:].isdigit()):
+                raise ValueError(f"unsupported code [{content}]")  # e.g. [DBNum1] numeral systems
+            index = end + 1
+        elif lower.startswith("am/pm"):
+            tokens.append(("ampm", section[index:index + 5]))
+            index += 5
+        elif lower.startswith("a/p"):
+            tokens.append(("ampm", section[index:index + 3]))
+            index += 3
+        elif lower.startswith("general"):
+            tokens.append(("general", section[index:index + 7]))
+            index += 7
+        elif char in "eE" and section[index + 1:index + 2] in ("+", "-"):
+            tokens.append(("exp", section[index + 1]))
+            index += 2
+        elif char.lower() in "ymdhs":
+            end = index
+            while end < length and section[end].lower() == char.lower():
+                end += 1
+            kind = {"y": "year", "m": "month_or_minute", "d": "day", "h": "hour", "s": "second"}[char.lower()]
+            tokens.append((kind, end - index))
+            index = end
+        elif char in "0#?":
+            tokens.append(("digit", char))
+            index += 1
+        elif char == ".":
+            tokens.append(("point", "."))
+            index += 1
+        elif char == ",":
+            tokens.append(("comma", ","))
+            index += 1
+        elif char == "/":
+            tokens.append(("slash", "/"))  # Date separator, or the bar of a fraction
+            index += 1
+        elif char == "%":
+            tokens.append(("percent", "%"))
+            index += 1
+        elif char == "@":
+            tokens.append(("text", "@"))
+            index += 1
+        else:
+            tokens.append(("literal", char))
+            index += 1
+    return tokens, condition
+
+
+def _round(value, decimals):
+    """Round half away from zero on the 15 significant digits Excel keeps, like Excel does."""
+    return Decimal(f"{value:.15g}").quantize(Decimal(1).scaleb(-decimals), rounding=ROUND_HALF_UP)
+
+
+def _group_thousands(digits):
+    head = len(digits) % 3 or 3
+    return ",".join([digits[:head]] + [digits[i:i + 3] for i in range(head, len(digits), 3)])
+
+
+def _compile_number_section(tokens):
+    """Return a function formatting a non-negative number with the tokens of a numeric section."""
+    if any(kind == "slash" for kind, _ in tokens):
+        raise ValueError("fractions are not supported")
+
+    # Commas between digit placeholders group thousands, commas after the last one divide by 1000
+    thousands = False
+    scale = 0
+    resolved = []
+    for position, token in enumerate(tokens):
+        if token[0] != "comma":
+            resolved.append(token)
+            continue
+        previous = resolved[-1][0] if resolved else None
+        following = tokens[position + 1][0] if position + 1 < len(tokens) else None
+        if previous == "digit" and following == "digit":
+            thousands = True
+        elif previous == "digit":
+            scale += 1
+        else:
+            resolved.append(("literal", ","))
+    tokens = resolved
+
+    percent = sum(1 for kind, _ in tokens if kind == "percent")
+    int_places = []
+    decimal_places = []
+    exponent_places = []
+    exponent_sign = None
+    part = int_places
+    for kind, text in tokens:
+        if kind == "digit":
+            part.append(text)
+        elif kind == "point" and part is int_places:
+            part = decimal_places
+        elif kind == "exp":
+            exponent_sign = text
+            part = exponent_places
+
+    def format_number(value):
+        value = value * 100 ** percent / 1000 ** scale
+        exponent = 0
+        if exponent_sign is not None and value:
+            exponent = math.floor(math.log10(value))
+            if "#" in int_places or "?" in int_places:
+                exponent = math.floor(exponent / max(len(int_places), 1)) * max(len(int_places), 1)
+            else:
+                exponent -= max(len(int_places), 1) - 1
+            value = value / 10 ** exponent
+            if _round(value, len(decimal_places)) >= 10 ** max(len(int_places), 1):
+                value /= 10
+                exponent += 1
+
+        int_text, _, decimal_text = format(_round(value, len(decimal_places)), "f").partition(".")
+        if int_text == "0":
+            int_text = ""
+
+        int_digits = [""] * len(int_places)
+        rest = int_text
+        for index in range(len(int_places) - 1, -1, -1):
+            if rest:
+                int_digits[index] = rest[-1]
+                rest = rest[:-1]
+            else:
+                int_digits[index] = {"0": "0", "?": " ", "#": ""}[int_places[index]]
+        if int_digits:
+            int_digits[0] = rest + int_digits[0]
+            if thousands:
+                padded = "".join(int_digits)
+                digits = padded.lstrip(" ")
+                int_digits = [" " * (len(padded) - len(digits)) + _group_thousands(digits)] + [""] * (len(int_digits) - 1)
+        else:
+            prefix = rest  # No integer placeholders (".00"), the integer digits go before the point
+
+        decimal_digits = list(decimal_text)
+        for index in range(len(decimal_places) - 1, -1, -1):
+            if decimal_digits[index] != "0" or decimal_places[index] == "0":
+                break
+            decimal_digits[index] = "" if decimal_places[index] == "#" else " "
+
+        exponent_text = str(abs(exponent)).zfill(sum(1 for place in exponent_places if place == "0"))
+        if exponent < 0:
+            exponent_text = "-" + exponent_text
+        elif exponent_sign == "+":
+            exponent_text = "+" + exponent_text
+
+        output = []
+        int_index = decimal_index = exponent_index = 0
+        part = "int"
+        for kind, text in tokens:
+            if kind == "digit":
+                if part == "int":
+                    output.append(int_digits[int_index])
+                    int_index += 1
+                elif part == "decimal":
+                    output.append(decimal_digits[decimal_index])
+                    decimal_index += 1
+                else:
+                    output.append(exponent_text if exponent_index == 0 else "")
+                    exponent_index += 1
+            elif kind == "point" and part == "int":
+                if not int_places:
+                    output.append(prefix)
+                output.append(".")
+                part = "decimal"
+            elif kind == "exp":
+                output.append("E")
+                part = "exponent"
+            elif kind == "general":
+                output.append(format_general(value))
+            elif kind in ("literal", "percent", "point"):
+                output.append(text)
+        return "".join(output)
+
+    return format_number
+
+
+def _compile_date_section(tokens):
+    """Return a function formatting a date, time or serial number with the tokens of a date section."""
+    date_kinds = [index for index, (kind, _) in enumerate(tokens) if kind in DATE_TOKENS]
+    # m is a minute right after an hour or right before a second, a month otherwise
+    resolved = list(tokens)
+    for position, index in enumerate(date_kinds):
+        if tokens[index][0] != "month_or_minute":
+            continue
+        previous = tokens[date_kinds[position - 1]] if position > 0 else None
+        following = tokens[date_kinds[position + 1]] if position + 1 < len(date_kinds) else None
+        is_minute = (previous is not None and (previous[0] == "hour" or previous == ("elapsed", "h") or previous == ("elapsed", "hh"))) \
+            or (following is not None and (following[0] == "second" or following[1] in ("s", "ss")))
+        resolved[index] = ("minute" if is_minute else "month", tokens[index][1])
+    tokens = resolved
+
+    twelve_hour = any(kind == "ampm" for kind, _ in tokens)
+    # Digits after the seconds are fractions of a second
+    fraction_digits = 0
+    after_point = False
+    for kind, text in tokens:
+        if kind == "point":
+            after_point = True
+        elif kind == "digit" and after_point and text == "0":
+            fraction_digits += 1
+        elif kind == "digit":
+            raise ValueError("digit placeholders in a date are only supported as fractions of a second")
+        else:
+            after_point = False
+
+    def format_date(value):
+        if isinstance(value, datetime.timedelta):
+            serial = value.total_seconds() / 86400
+        elif isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            serial = to_excel(value)
+        else:
+            serial = float(value)
+        if serial < 0:
+            return "#" * GENERAL_WIDTH  # Excel cannot show negative dates
+
+        # Seconds are rounded to the shown precision, so 10:00:59.6 shows as 10:01:00
+        serial = round(serial * 86400 * 10 ** fraction_digits) / (86400 * 10 ** fraction_digits)
+        moment = from_excel(serial)
+        if isinstance(moment, datetime.time):
+            moment = datetime.datetime.combine(datetime.date(1899, 12, 30), moment)
+        elif isinstance(moment, datetime.timedelta):
+            moment = datetime.datetime(1899, 12, 30) + moment
+        elif not isinstance(moment, datetime.datetime):
+            moment = datetime.datetime.combine(moment, datetime.time())
+
+        output = []
+        after_point = False
+        fraction = f"{moment.microsecond / 1_000_000:.{fraction_digits}f}".partition(".")[2] if fraction_digits else ""
+        fraction_index = 0
+        for kind, text in tokens:
+            if kind == "year":
+                output.append(f"{moment.year % 100:02d}" if text <= 2 else f"{moment.year:04d}")
+            elif kind == "month":
+                output.append([str(moment.month), f"{moment.month:02d}", MONTH_NAMES[moment.month - 1][:3],
+                               MONTH_NAMES[moment.month - 1], MONTH_NAMES[moment.month - 1][0]][min(text, 5) - 1])
+            elif kind == "day":
+                output.append([str(moment.day), f"{moment.day:02d}", DAY_NAMES[moment.weekday()][:3],
+                               DAY_NAMES[moment.weekday()]][min(text, 4) - 1])
+            elif kind == "hour":
+                hour = moment.hour % 12 or 12 if twelve_hour else moment.hour
+                output.append(str(hour) if text == 1 else f"{hour:02d}")
+            elif kind == "minute":
+                output.append(str(moment.minute) if text == 1 else f"{moment.minute:02d}")
+            elif kind == "second":
+                output.append(str(moment.second) if text == 1 else f"{moment.second:02d}")
+            elif kind == "ampm":
+                marker = ("AM" if moment.hour < 12 else "PM") if len(text) == 5 else ("A" if moment.hour < 12 else "P")
+                output.append(marker.lower() if text[0].islower() else marker)
+            elif kind == "elapsed":
+                total_seconds = round(serial * 86400)
+                elapsed = {"h": total_seconds // 3600, "m": total_seconds // 60, "s": total_seconds}[text[0]]
+                output.append(str(elapsed).zfill(len(text)))
+            elif kind == "digit" and after_point and fraction_index < len(fraction):
+                output.append(fraction[fraction_index])
+                fraction_index += 1
+                continue
+            elif kind not in ("general", "text"):
+                output.append(str(text))
+            after_point = kind == "point" or (after_point and kind == "digit")
+        return "".join(output)
+
+    return format_date
+
+
+def _compile_text_section(tokens):
+    """Return a function formatting a string with the tokens of a text section."""
+    def format_text(value):
+        return "".join(str(value) if kind == "text" else text for kind, text in tokens
+                       if kind in ("text", "literal", "comma", "point", "slash", "percent", "digit"))
+    return format_text
+
+
+def _compile_section(section):
+    tokens, condition = _tokenize(section)
+    kinds = {kind for kind, _ in tokens}
+    if kinds & DATE_TOKENS:
+        return condition, "date", _compile_date_section(tokens)
+    if "text" in kinds and "digit" not in kinds:
+        return condition, "text", _compile_text_section(tokens)
+    if not tokens:
+        return condition, "empty", lambda value: ""
+    return condition, "number", _compile_number_section(tokens)
+
+
+@functools.lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def compile_number_format(number_format):
+    """
+    Compile an Excel number format into a function returning the text Excel shows for a value.
+    Handles sections (positive;negative;zero;text), conditions, thousands separators and
+    scaling commas, percentages, scientific notation, currency and literal text, dates and times.
+    Compiled formats are cached, so formatting a value is a cache lookup and a call.
+    Formats using constructs that are not implemented (fractions, numeral system codes) show
+    values as General rather than as wrong text.
+    """
+    if not number_format or number_format.lower() == "general":
+        return format_general
+
+    try:
+        sections = [_compile_section(section) for section in _split_sections(number_format)]
+    except Exception as e:
+        print(f"Unsupported number format '{number_format}': {e}")
+        return format_general
+
+    text_section = sections[3] if len(sections) > 3 else next(
+        (section for section in sections[:1] if section[1] == "text"), None)
+    numeric_sections = sections[:3]
+    conditional = any(condition is not None for condition, _, _ in numeric_sections)
+
+    def select_section(value):
+        """Return the section used for a number and whether the number loses its minus sign."""
+        if conditional:
+            for condition, kind, formatter in numeric_sections:
+                if condition is None or _check_condition(condition, value):
+                    # The sign is implied by a condition only matching negative numbers
+                    implied = condition is not None and condition[0] in ("<", "<=") and condition[1] <= 0
+                    return (condition, kind, formatter), implied
+            return None, False
+        if len(numeric_sections) == 1 or value > 0 or (value == 0 and len(numeric_sections) == 2):
+            return numeric_sections[0], False
+        if value < 0:
+            return numeric_sections[1], True
+        return numeric_sections[2], False
+
+    def format_value(value):
+        if isinstance(value, str):
+            return text_section[2](value) if text_section is not None else value
+        if isinstance(value, bool):
+            return format_general(value)
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time, datetime.timedelta)):
+            date_section = next((section for section in numeric_sections if section[1] == "date"), None)
+            return date_section[2](value) if date_section is not None else str(value)
+        if not isinstance(value, numbers.Real) or not math.isfinite(value):
+            return str(value)
+
+        section, sign_implied = select_section(value)
+        if section is None:
+            return "#" * GENERAL_WIDTH
+        _, kind, formatter = section
+        if kind == "text":
+            return format_general(value)
+        if kind == "empty":
+            return ""
+        text = formatter(abs(value) if kind == "number" else value)
+        if value < 0 and kind == "number" and not sign_implied:
+            text = "-" + text
+        return text
+
+    return format_value
@@ -0,0 +1,336 @@
+import os
+import posixpath
+import struct
+import tempfile
+import zipfile
+import zlib
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the chunks used when copying the compressed bytes of untouched members
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Values above these limits need the ZIP64 extensions, the 32/16-bit fields then hold the marker
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+ZIP64_MARKER = 0xFFFFFFFF
+ZIP64_COUNT_MARKER = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+END_OF_CENTRAL_DIR_64 = struct.Struct("<4sQ2H2L4Q")
+END_OF_CENTRAL_DIR_64_LOCATOR = struct.Struct("<4sLQL")
+
+# Compression presets: (method, deflate level)
+COMPRESSION_PRESETS = {
+    "stored": (zipfile.ZIP_STORED, None),
+    "fast": (zipfile.ZIP_DEFLATED, 1),
+    "default": (zipfile.ZIP_DEFLATED, 6),
+    "max": (zipfile.ZIP_DEFLATED, 9),
+}
+
+# Preset used for each kind of changed member (see member_kind)
+DEFAULT_COMPRESSION_POLICY = {
+    "xml": "default",
+    "embedding": "stored",
+    "media": "stored",
+    "other": "default",
+}
+
+# Formats that are compressed already and are always stored (embedded Office files are ZIPs)
+COMPRESSED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".jfif", ".gif", ".tif", ".tiff", ".wdp", ".emz", ".wmz",
+    ".mp4", ".m4v", ".mov", ".wmv", ".avi", ".mp3", ".m4a", ".wma",
+    ".zip", ".xlsx", ".xlsm", ".docx", ".pptx", ".odt", ".ods",
+}
+
+# Flag bit 3 means sizes and CRC follow the data in a data descriptor, we always write them up front
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+
+def member_kind(name):
+    """Kind of a package member for the compression policy: xml, embedding, media or other."""
+    if name.startswith('ppt/embeddings/'):
+        return "embedding"
+    if name.startswith('ppt/media/'):
+        return "media"
+    if name.endswith('.xml') or name.endswith('.rels'):
+        return "xml"
+    return "other"
+
+
+def resolve_compression_policy(compression=None):
+    """
+    Return the preset of each member kind from a compression setting: None for the default policy,
+    a preset name applied to the xml and other members, or a dict of kind to preset name.
+    """
+    policy = dict(DEFAULT_COMPRESSION_POLICY)
+    if isinstance(compression, str):
+        policy["xml"] = policy["other"] = compression
+    elif compression:
+        policy.update(compression)
+    for kind, preset in policy.items():
+        if preset not in COMPRESSION_PRESETS:
+            raise ValueError(f"Unknown compression preset '{preset}' for {kind} members")
+    return policy
+
+
+def member_compression(name, policy):
+    """Compression method and level of a changed member under a resolved policy."""
+    if posixpath.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return COMPRESSION_PRESETS["stored"]
+    return COMPRESSION_PRESETS[policy[member_kind(name)]]
+
+
+def compress_member(data, compress_type=zipfile.ZIP_DEFLATED, compresslevel=6):
+    """Return (CRC, payload) of the content of a member compressed with the given method."""
+    if compress_type == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+        return zlib.crc32(data), compressor.compress(data) + compressor.flush()
+    if compress_type == zipfile.ZIP_STORED:
+        return zlib.crc32(data), data
+    raise ValueError(f"Unsupported compression method {compress_type}")
+
+
+def compress_members(members, policy, threads=1):
+    """
+    Compress the content of changed members, by name, following a resolved policy.
+    zlib releases the GIL, so with threads > 1 the members are compressed in parallel.
+    Returns {name: (compress_type, CRC, payload, size)}.
+    """
+    def compress(name):
+        compress_type, compresslevel = member_compression(name, policy)
+        crc, payload = compress_member(members[name], compress_type, compresslevel)
+        return name, (compress_type, crc, payload, len(members[name]))
+
+    if threads > 1 and len(members) > 1:
+        with ThreadPoolExecutor(max_workers=min(threads, len(members))) as pool:
+            return dict(pool.map(compress, members))
+    return dict(compress(name) for name in members)
+
+
+def compression_windows(names, sizes, memory_limit=None):
+    """
+    Split the changed members, in write order, into windows compressed one at a time, each holding
+    about memory_limit / 2 bytes of content (the other half is left for the compressed payloads).
+    Without a memory limit all members are compressed in a single window.
+    """
+    if not memory_limit:
+        return [list(names)] if names else []
+    windows = []
+    window_bytes = 0
+    for name in names:
+        if not windows or (windows[-1] and window_bytes + sizes[name] > memory_limit // 2):
+            windows.append([])
+            window_bytes = 0
+        windows[-1].append(name)
+        window_bytes += sizes[name]
+    return windows
+
+
+class PartStore(MutableMapping):
+    """
+    Dict of part name to content that keeps at most memory_limit bytes in memory, the parts
+    added beyond that are spilled to a temporary file and read back when they are written.
+    Without a memory limit every part is kept in memory.
+    """
+
+    def __init__(self, memory_limit=None):
+        self.memory_limit = memory_limit
+        self.memory_bytes = 0
+        self._parts = {}
+        self._spilled = {}
+        self._spill_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._parts.clear()
+        self._spilled.clear()
+        self.memory_bytes = 0
+
+    def __setitem__(self, name, content):
+        if name in self:
+            del self[name]
+        if self.memory_limit and self.memory_bytes + len(content) > self.memory_limit:
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix='powerpoint_parts_')
+            offset = self._spill_file.seek(0, os.SEEK_END)
+            self._spill_file.write(content)
+            self._spilled[name] = (offset, len(content))
+        else:
+            self._parts[name] = content
+            self.memory_bytes += len(content)
+
+    def __getitem__(self, name):
+        if name in self._parts:
+            return self._parts[name]
+        offset, size = self._spilled[name]
+        self._spill_file.seek(offset)
+        return self._spill_file.read(size)
+
+    def __delitem__(self, name):
+        if name in self._parts:
+            self.memory_bytes -= len(self._parts.pop(name))
+        else:
+            del self._spilled[name]  # The space in the spill file is only freed on close
+
+    def __contains__(self, name):
+        return name in self._parts or name in self._spilled
+
+    def __iter__(self):
+        yield from self._parts
+        yield from self._spilled
+
+    def __len__(self):
+        return len(self._parts) + len(self._spilled)
+
+    @property
+    def spilled_parts(self):
+        return len(self._spilled)
+
+    def size(self, name):
+        """Length of a part's content, without reading back a spilled part."""
+        if name in self._parts:
+            return len(self._parts[name])
+        return self._spilled[name][1]
+
+
+class PackageWriter:
+    """
+    Minimal ZIP writer used to rewrite PowerPoint packages.
+    Untouched members are copied with their compressed bytes, compression method and CRC
+    as they are in the source package, only the members that change are compressed again.
+    """
+
+    def __init__(self, fileobj):
+        self.fp = fileobj
+        self.entries = []
+        self.bytes_written = 0
+        self.parts_changed = 0
+        self.parts_copied = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def _write(self, data):
+        self.fp.write(data)
+        self.bytes_written += len(data)
+
+    def _write_local_header(self, name, flag_bits, compress_type, date_time, crc, compress_size, file_size):
+        """Write the local file header of a member and record its central directory entry."""
+        filename = name.encode("utf-8")
+        if not name.isascii():
+            flag_bits |= FLAG_UTF8
+        flag_bits &= ~FLAG_DATA_DESCRIPTOR
+
+        zip64 = compress_size >= ZIP64_LIMIT or file_size >= ZIP64_LIMIT
+        extra = b""
+        if zip64:
+            extra = struct.pack("<2H2Q", 1, 16, file_size, compress_size)
+        version = 45 if zip64 else 20
+
+        dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+        dos_time = date_time[3] << 11 | date_time[4] << 5 | (date_time[5] // 2)
+
+        self.entries.append({
+            "filename": filename,
+            "flag_bits": flag_bits,
+            "compress_type": compress_type,
+            "dos_time": dos_time,
+            "dos_date": dos_date,
+            "crc": crc,
+            "compress_size": compress_size,
+            "file_size": file_size,
+            "header_offset": self.bytes_written,
+        })
+
+        self._write(LOCAL_HEADER.pack(
+            b"PK\003\004", version, 0, flag_bits, compress_type, dos_time, dos_date, crc,
+            ZIP64_MARKER if zip64 else compress_size,
+            ZIP64_MARKER if zip64 else file_size,
+            len(filename), len(extra)))
+        self._write(filename)
+        self._write(extra)
+
+    def copy_member(self, source_fp, info):
+        """Copy a member of the source package verbatim, without decompressing it."""
+        source_fp.seek(info.header_offset)
+        header = LOCAL_HEADER.unpack(source_fp.read(LOCAL_HEADER.size))
+        name_length, extra_length = header[-2], header[-1]
+        source_fp.seek(info.header_offset + LOCAL_HEADER.size + name_length + extra_length)
+
+        self._write_local_header(info.filename, info.flag_bits, info.compress_type, info.date_time,
+                                 info.CRC, info.compress_size, info.file_size)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = source_fp.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated member '{info.filename}' in source package")
+            self._write(chunk)
+            remaining -= len(chunk)
+        self.parts_copied += 1
+
+    def write_compressed_member(self, info, compressed):
+        """Write a member compressed beforehand by compress_members, keeping the name and timestamp of info."""
+        compress_type, crc, payload, file_size = compressed
+        self._write_local_header(info.filename, 0, compress_type, info.date_time, crc, len(payload), file_size)
+        self._write(payload)
+        self.parts_changed += 1
+
+    def close(self):
+        """Write the central directory and the end of central directory records."""
+        central_dir_offset = self.bytes_written
+        for entry in self.entries:
+            compress_size = entry["compress_size"]
+            file_size = entry["file_size"]
+            header_offset = entry["header_offset"]
+
+            zip64_fields = []
+            if file_size >= ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = ZIP64_MARKER
+            if compress_size >= ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = ZIP64_MARKER
+            if header_offset >= ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = ZIP64_MARKER
+
+            extra = b""
+            if zip64_fields:
+                extra = struct.pack(f"<2H{len(zip64_fields)}Q", 1, 8 * len(zip64_fields), *zip64_fields)
+            version = 45 if zip64_fields else 20
+
+            self._write(CENTRAL_HEADER.pack(
+                b"PK\001\002", version, 0, version, 0, entry["flag_bits"], entry["compress_type"],
+                entry["dos_time"], entry["dos_date"], entry["crc"], compress_size, file_size,
+                len(entry["filename"]), len(extra), 0, 0, 0, 0, header_offset))
+            self._write(entry["filename"])
+            self._write(extra)
+
+        central_dir_size = self.bytes_written - central_dir_offset
+        count = len(self.entries)
+        if count >= ZIP64_COUNT_LIMIT or central_dir_offset >= ZIP64_LIMIT or central_dir_size >= ZIP64_LIMIT:
+            zip64_end_offset = self.bytes_written
+            self._write(END_OF_CENTRAL_DIR_64.pack(
+                b"PK\006\006", 44, 45, 45, 0, 0, count, count, central_dir_size, central_dir_offset))
+            self._write(END_OF_CENTRAL_DIR_64_LOCATOR.pack(b"PK\006\007", 0, zip64_end_offset, 1))
+            count = min(count, ZIP64_COUNT_MARKER)
+            central_dir_size = min(central_dir_size, ZIP64_MARKER)
+            central_dir_offset = min(central_dir_offset, ZIP64_MARKER)
+
+        self._write(END_OF_CENTRAL_DIR.pack(b"PK\005\006", 0, 0, count, count, central_dir_size, central_dir_offset, 0))
@@ -0,0 +1,256 @@
+import os
+import pickle
+import tempfile
+import uuid
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.exceptions import CellCoordinatesException
+import instrumentation
+from ppt_workbook_update import analyze_excel_markers, discard_process_pool, shared_process_pool, write_updated_pptx
+from render_manifest import fingerprint
+from workbook_snapshot import load_workbook_selection, load_workbook_snapshot
+from deck_template import file_size, hash_file, load_deck_template, template_references
+from xlsx_reader import scan_workbook_markers
+from refreshCharts import refreshCharts  # only works on Windows and will not work with Linux or Mac
+
+REFRESH_ERROR_MESSAGE = "The chart refresh is incomplete. The workbook for the chart has been updated, but the chart cache could not be recomputed. You can manually refresh the chart clicking on 'I will run the macro myself' and run the macro by yourself"
+
+
+def _row_spans(mapping, cells):
+    """First and last row of each sheet read by the markers of mapping and by the placeholder cells."""
+    rows = {}
+    for entry in mapping.values():
+        rows.setdefault(entry["sheet_name"], []).extend((entry["start_row"], entry["end_row"]))
+    for sheet_name, cell_refs in cells.items():
+        sheet_rows = rows.setdefault(sheet_name, [])
+        for cell_ref in cell_refs:
+            try:
+                sheet_rows.append(coordinate_from_string(cell_ref)[1])
+            except CellCoordinatesException:
+                pass  # Shown as an empty value, the sheet is still loaded
+    return {sheet_name: (min(sheet_rows), max(sheet_rows)) if sheet_rows else (1, 0)
+            for sheet_name, sheet_rows in rows.items()}
+
+
+def load_workbook_and_markers(excel_file_path, workbook_cache=None, references=None, workbook_hash=None):
+    """
+    Load the snapshot and marker mapping of a workbook. With a WorkbookCache, a workbook whose
+    content was loaded before is taken from the cache, without opening it with openpyxl.
+    With references (see deck_template.template_references), only what the decks read is loaded:
+    the markers are found by scanning column A of the sheet XML, then only the sheets holding the
+    referenced markers and placeholder cells are parsed, each over the span of rows they cover.
+    The mapping then only holds the referenced markers. workbook_hash is the hash_file digest
+    of the workbook when the caller already has it.
+    """
+    if workbook_cache is not None:
+        if workbook_hash is None:
+            with instrumentation.stage("workbook_hash", bytes=file_size(excel_file_path)):
+                workbook_hash = hash_file(excel_file_path)
+        cache_key = workbook_hash if references is None else fingerprint(workbook_hash, references)
+        with instrumentation.stage("workbook_cache") as timed:
+            cached = workbook_cache.get(cache_key)
+            timed.count = 0 if cached is None else 1
+        if cached is not None:
+            return cached
+
+    if references is None:
+        # Load the Excel workbook once into an in-memory snapshot shared by all stages
+        with instrumentation.stage("workbook_load", bytes=file_size(excel_file_path)):
+            workbook = load_workbook_snapshot(excel_file_path)
+
+        with instrumentation.stage("marker_analysis") as timed:
+            mapping = analyze_excel_markers(workbook)
+            timed.count = len(mapping)
+    else:
+        with instrumentation.stage("marker_scan", bytes=file_size(excel_file_path)) as timed:
+            all_markers = scan_workbook_markers(excel_file_path)
+            mapping = {marker_name: all_markers[marker_name] for marker_name in references["markers"]
+                       if marker_name in all_markers}
+            timed.count = len(mapping)
+
+        row_spans = _row_spans(mapping, references["cells"])
+        with instrumentation.stage("workbook_load", bytes=file_size(excel_file_path), count=len(row_spans)):
+            workbook = load_workbook_selection(excel_file_path, row_spans)
+
+    if workbook_cache is not None:
+        with instrumentation.stage("workbook_cache_store"):
+            workbook_cache.put(cache_key, workbook, mapping)
+    return workbook, mapping
+
+
+def render_deck(ppt_file_path, excel_file_path, output_ppt_file, template_cache_dir, workers=1, previous_output=None,
+                compression=None, memory_limit=None, workbook_cache=None, selective_load=True, deck_hash=None,
+                workbook_hash=None):
+    """
+    Update a deck from an Excel workbook and write the result to output_ppt_file.
+    The deck and the workbook are paths or seekable binary file objects (e.g. upload buffers).
+    Module-level so it can run in worker processes. workers is the number of processes used to
+    render the embeddings and slides of the deck. previous_output is an earlier output of the same
+    deck whose unchanged parts are reused (see write_updated_pptx). compression is the compression
+    policy of the changed members (see package_writer.resolve_compression_policy) and memory_limit
+    bounds the rendered content held in memory (see write_updated_pptx). workbook_cache is an optional
+    WorkbookCache of loaded workbooks (see load_workbook_and_markers). The deck template is compiled
+    first, so only the sheets and rows of the workbook it references are loaded, unless
+    selective_load is False. deck_hash and workbook_hash are the hash_file digests of the inputs
+    when the caller already computed them, so they are not hashed again. Returns the stats of
+    write_updated_pptx with the duration of each stage in seconds under 'timings', and the duration,
+    bytes and count of every instrumented stage under 'stages' (see instrumentation.py).
+    """
+    with instrumentation.collect() as trace:
+        # Compiled template of the deck (embedding markers and placeholder slots), cached by content hash
+        with instrumentation.stage("template", bytes=file_size(ppt_file_path)):
+            template = load_deck_template(ppt_file_path, template_cache_dir, deck_hash=deck_hash)
+
+        references = template_references([template]) if selective_load else None
+        workbook, mapping = load_workbook_and_markers(excel_file_path, workbook_cache, references, workbook_hash)
+
+    stats = render_loaded_deck(ppt_file_path, workbook, mapping, output_ppt_file, template_cache_dir, workers, previous_output,
+                               compression, memory_limit, template)
+    stats["timings"] = {**{name: stage["seconds"] for name, stage in trace.stages.items()}, **stats["timings"]}
+    trace.merge(stats["stages"])
+    stats["stages"] = trace.stages
+    return stats
+
+
+def render_loaded_deck(ppt_file_path, workbook, mapping, output_ppt_file, template_cache_dir, workers=1, previous_output=None,
+                       compression=None, memory_limit=None, template=None):
+    """
+    Update a deck like render_deck, from a workbook snapshot and marker mapping that are already loaded,
+    and its compiled template when it is loaded too.
+    """
+    with instrumentation.collect() as trace:
+        if template is None:
+            # Compiled template of the deck (embedding markers and placeholder slots), cached by content hash
+            with instrumentation.stage("template", bytes=file_size(ppt_file_path)):
+                template = load_deck_template(ppt_file_path, template_cache_dir)
+
+        # Configuration dictionary for modifying embedded Excel files
+        config_modify = {
+            'ppt_file_path': ppt_file_path,
+            'workbook': workbook,
+            'mapping': mapping,
+            'template': template,
+            'workers': workers,
+            'previous_output': previous_output,
+            'compression': compression,
+            'memory_limit': memory_limit
+        }
+
+        # Modify embedded Excel files in the PowerPoint based on the marker mapping
+        # and stream the updated package straight to the output file path
+        with instrumentation.stage("render") as timed:
+            stats = write_updated_pptx(config_modify, output_ppt_file)
+            timed.bytes = stats["bytes_written"]
+    print(f"Wrote {stats['bytes_written']} bytes, {stats['parts_changed']} parts changed, {stats['parts_reused']} reused")
+
+    stats["timings"] = {name: trace.stages[name]["seconds"] for name in ("template", "render") if name in trace.stages}
+    stats["stages"] = trace.stages
+    return stats
+
+
+# Workbook of the batch a worker process renders decks of, read once per process and batch by _batch_workbook
+_batch_state = {}
+
+def _batch_workbook(state_path):
+    """Workbook and mapping of a batch, from the file render_batch wrote them to."""
+    if _batch_state.get("path") != state_path:
+        with open(state_path, 'rb') as f:
+            workbook, mapping = pickle.load(f)
+        _batch_state.update(path=state_path, workbook=workbook, mapping=mapping)
+    return _batch_state["workbook"], _batch_state["mapping"]
+
+def _render_batch_deck(state_path, ppt_file_path, output_ppt_file, template_cache_dir, template=None):
+    workbook, mapping = _batch_workbook(state_path)
+    return render_loaded_deck(ppt_file_path, workbook, mapping, output_ppt_file, template_cache_dir, template=template)
+
+
+def render_batch(ppt_file_paths, excel_file_path, output_dir, template_cache_dir, workers=1, workbook_cache=None):
+    """
+    Update several decks from the same Excel workbook, which is loaded and indexed once
+    (or taken from workbook_cache, see load_workbook_and_markers), over the sheets and rows
+    referenced by any of the decks.
+    The decks are rendered by the shared pool of workers processes (see shared_process_pool), which
+    read the loaded workbook once per batch from a file in output_dir. Returns the timings of the workbook stages
+    and a generator yielding, as each deck finishes, a dict with its 'ppt_file_path',
+    'output_ppt_file', and 'stats' or 'error' (a failed deck does not stop the others).
+    """
+    with instrumentation.collect() as trace:
+        templates = {}
+        for ppt_file_path in ppt_file_paths:
+            try:
+                with instrumentation.stage("template", bytes=file_size(ppt_file_path)):
+                    templates[ppt_file_path] = load_deck_template(ppt_file_path, template_cache_dir)
+            except Exception as e:
+                # The deck fails again when it is rendered, with the error in its result
+                print(f"Failed to compile the template of '{ppt_file_path}': {e}")
+        workbook, mapping = load_workbook_and_markers(excel_file_path, workbook_cache,
+                                                      template_references(templates.values()))
+    timings = {name: stage["seconds"] for name, stage in trace.stages.items()}
+
+    # Output names follow /upload, decks uploaded under the same name get a numbered prefix
+    outputs = []
+    used_names = set()
+    for index, ppt_file_path in enumerate(ppt_file_paths):
+        updated_filename = os.path.basename(ppt_file_path).replace('.ppt', '_updated.ppt')
+        if updated_filename in used_names:
+            updated_filename = f"{index + 1}_{updated_filename}"
+        used_names.add(updated_filename)
+        outputs.append((ppt_file_path, os.path.join(output_dir, updated_filename)))
+
+    def results():
+        if workers <= 1 or len(outputs) <= 1:
+            for ppt_file_path, output_ppt_file in outputs:
+                try:
+                    stats = render_loaded_deck(ppt_file_path, workbook, mapping, output_ppt_file, template_cache_dir,
+                                               template=templates.get(ppt_file_path))
+                except Exception as e:
+                    print(f"Failed to render '{ppt_file_path}': {e}")
+                    yield {"ppt_file_path": ppt_file_path, "output_ppt_file": output_ppt_file, "error": str(e)}
+                else:
+                    yield {"ppt_file_path": ppt_file_path, "output_ppt_file": output_ppt_file, "stats": stats}
+            return
+
+        # Named uniquely, workers keep the workbook of the last batch they rendered by this path
+        fd, state_path = tempfile.mkstemp(prefix=f".batch_{uuid.uuid4().hex}_", suffix=".pickle", dir=output_dir)
+        pool = shared_process_pool(workers)
+        futures = {}
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((workbook, mapping), f, protocol=pickle.HIGHEST_PROTOCOL)
+            for ppt_file_path, output_ppt_file in outputs:
+                future = pool.submit(_render_batch_deck, state_path, ppt_file_path, output_ppt_file,
+                                     template_cache_dir, templates.get(ppt_file_path))
+                futures[future] = (ppt_file_path, output_ppt_file)
+            for future in as_completed(futures):
+                ppt_file_path, output_ppt_file = futures[future]
+                try:
+                    stats = future.result()
+                except BrokenProcessPool:
+                    discard_process_pool(pool)
+                    raise
+                except Exception as e:
+                    print(f"Failed to render '{ppt_file_path}': {e}")
+                    yield {"ppt_file_path": ppt_file_path, "output_ppt_file": output_ppt_file, "error": str(e)}
+                else:
+                    yield {"ppt_file_path": ppt_file_path, "output_ppt_file": output_ppt_file, "stats": stats}
+        finally:
+            # A batch abandoned by its reader (client gone) does not keep the shared workers busy
+            for future in futures:
+                future.cancel()
+            os.remove(state_path)
+
+    return timings, results()
+
+
+def refresh_deck(output_ppt_file):
+    """Refresh the charts of a rendered deck with PowerPoint. Returns an error message, or None on success."""
+    try:
+        print("before refreshing")
+        with instrumentation.stage("powerpoint_refresh", bytes=os.path.getsize(output_ppt_file)):
+            refreshCharts(output_ppt_file)  # window only
+    except Exception as e:
+        print(f"refreshCharts failed: {e}")
+        print("error_message", REFRESH_ERROR_MESSAGE)
+        return REFRESH_ERROR_MESSAGE  # you could add {urllib.parse.quote(vba_code)}
+    return None
@@ -2,11 +2,48 @@ import tempfile
 import io
 import zipfile
 import os
-import osax
+import posixpath
 import re
-import shutil
+from bisect import bisect_right
+import time
+import multiprocessing
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+from lxml import etree
 from pptx import Presentation
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+import instrumentation
+from package_writer import PackageWriter, PartStore, compress_members, compression_windows, resolve_compression_policy
+from workbook_snapshot import CellSnapshot
+from xlsx_writer import write_xlsx
+from xlsx_reader import read_active_sheet_a1
+from number_format import compile_number_format
+from render_manifest import fingerprint, load_manifest, save_manifest
+
+# Namespaces used by chart parts and their relationship files
+CHART_NS = "http://schemas.openxmlformats.org/drawingml/2006/chart"
+C15_NS = "http://schemas.microsoft.com/office/drawing/2012/chart"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# Placeholder for a single cell value in slide text, e.g. [[Sheet1!B2]]
+PLACEHOLDER_PATTERN = re.compile(r'\[\[([A-Za-z0-9_ ]+?)!(\w+)\]\]')
+PLACEHOLDER_BYTES_PATTERN = re.compile(PLACEHOLDER_PATTERN.pattern.encode('ascii'))
+
+# DrawingML paragraphs and the text of their runs, where placeholders are looked for
+PARAGRAPH_PATTERN = re.compile(rb'<a:p[ >].*?</a:p>', re.S)
+TEXT_PATTERN = re.compile(rb'<a:t(?:\s[^>]*)?>([^<]*)</a:t>')
+
+# Parts whose text can hold placeholders: slides, notes, layouts, masters and charts (titles, labels)
+TEXT_PART_PATTERN = re.compile(r'^ppt/(?:slides|notesSlides|slideLayouts|slideMasters|charts)/[^/]+\.xml$')
+
+# Sheet-qualified A1 range as stored in c:f, e.g. Sheet1!$B$2:$B$7 or 'My Sheet'!$A$1
+CHART_REF_PATTERN = re.compile(r"^((?:'(?:[^']|'')+'|[^!]+)!)\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$")
 
 def analyze_excel_markers(workbook):
     """Analyze the Excel workbook to get all markers (sheet name, start, and end) and create a mapping."""
@@ -39,154 +76,659 @@ def analyze_excel_markers(workbook):
 
     return mapping
 
-def copy_cells_into_embedded_workbook(source_workbook, mapping, marker_name, embedded_sheet_name):
-    """Create a new workbook and copy cells from the source Excel sheet based on the marker."""
-    try:
-        if marker_name not in mapping:
-            print(f"Marker '{marker_name}' not found in the Excel mapping. Skipping chart.")
-            return None  # Return None if marker not found
+def get_marker_rows(source_workbook, mapping, marker_name):
+    """Read the rows of the source sheet that belong to the given marker."""
+    if marker_name not in mapping:
+        print(f"Marker '{marker_name}' not found in the Excel mapping. Skipping chart.")
+        return None  # Return None if marker not found
 
-        mapping_info = mapping[marker_name]
-        source_sheet_name = mapping_info["sheet_name"]
-        source_start_row = mapping_info["start_row"]
-        source_end_row = mapping_info["end_row"]
+    mapping_info = mapping[marker_name]
+    source_worksheet = source_workbook[mapping_info["sheet_name"]]
+    return list(source_worksheet.iter_rows(min_row=mapping_info["start_row"], max_row=mapping_info["end_row"], values_only=True))
 
-        source_worksheet = source_workbook[source_sheet_name]
-        
-        # Create a new workbook object
-        new_workbook = Workbook()
-        new_worksheet = new_workbook.create_sheet(title=embedded_sheet_name)
-        new_workbook.remove(new_workbook.active)
+def build_embedded_workbook(embedded_sheet_name, rows):
+    """Create a new workbook holding the given rows on a sheet named like the embedded one."""
+    new_workbook = Workbook()
+    new_worksheet = new_workbook.create_sheet(title=embedded_sheet_name)
+    new_workbook.remove(new_workbook.active)
 
-        for source_row_idx, row in enumerate(source_worksheet.iter_rows(min_row=source_start_row, max_row=source_end_row, values_only=True), start=1):
-            for col_idx, cell_value in enumerate(row, start=1):
-                new_worksheet.cell(row=source_row_idx, column=col_idx).value = cell_value
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, cell_value in enumerate(row, start=1):
+            new_worksheet.cell(row=row_idx, column=col_idx).value = cell_value
 
-        return new_workbook  # Return the new workbook
+    return new_workbook
 
-    except Exception as e:
-        print(f"Failed to copy data for marker '{marker_name}': {e}")
+def encode_embedded_workbook(embedded_sheet_name, rows):
+    """Return the .xlsx content of a new embedded workbook holding the given rows."""
+    # Written directly as sheet XML, building an openpyxl Workbook costs an order of magnitude more
+    return write_xlsx(embedded_sheet_name, rows)
+
+def read_embedded_marker(embedded_file, embedded_content):
+    """
+    Read the pptstart: marker in A1 of an embedded workbook.
+    Returns the name of its active sheet and the marker name, or None if there is no valid marker.
+    """
+    # Only workbook.xml, the start of the sheet XML and of sharedStrings.xml are parsed
+    embedded_sheet_name, marker = read_active_sheet_a1(embedded_content)
+    if marker is None or not isinstance(marker, str) or not marker.startswith("pptstart:"):
+        print(f"No valid marker found in A1 of the embedded workbook '{embedded_file}'. Skipping.")
         return None
 
+    return embedded_sheet_name, marker.split(":")[1]
+
+def regenerate_embedded_workbook(embedded_file, embedded_sheet_name, marker_name, workbook, mapping):
+    """
+    Build the new content of an embedded workbook from the rows of its marker.
+    Returns the embedded file name, the new workbook content and the copied rows
+    (used to rebuild the chart caches), or None if the marker is not in the mapping.
+    """
+    rows = get_marker_rows(workbook, mapping, marker_name)
+    if rows is None:
+        return None
+
+    chart_source = {"sheet_name": embedded_sheet_name, "rows": rows}
+    return embedded_file, encode_embedded_workbook(embedded_sheet_name, rows), chart_source
+
 def process_embedded_workbook(embedded_file, embedded_content, workbook, mapping):
-    """Process each embedded Excel workbook from in-memory ZIP."""
+    """
+    Process each embedded Excel workbook from in-memory ZIP.
+    Returns the same result as regenerate_embedded_workbook, or None if the embedding was left untouched.
+    """
     try:
-        # embedded_workbook = load_workbook(io.BytesIO(embedded_content), read_only=True)
-        embedded_workbook = load_workbook(io.BytesIO(embedded_content), read_only=True, data_only=True)
-        # embedded_workbook = load_workbook(io.BytesIO(embedded_content))
-        sheet_embedded = embedded_workbook.active
-        embedded_sheet_name = sheet_embedded.title
-
-        marker = sheet_embedded['A1'].value
-        if marker is None or not isinstance(marker, str) or not marker.startswith("pptstart:"):
-            print(f"No valid marker found in A1 of the embedded workbook '{embedded_file}'. Skipping.")
+        marker = read_embedded_marker(embedded_file, embedded_content)
+        if marker is None:
             return None
 
-        marker_name = marker.split(":")[1]
+        embedded_sheet_name, marker_name = marker
+        return regenerate_embedded_workbook(embedded_file, embedded_sheet_name, marker_name, workbook, mapping)
 
-        new_workbook = copy_cells_into_embedded_workbook(workbook, mapping, marker_name, embedded_sheet_name)
+    except Exception as e:
+        print(f"Failed to modify '{embedded_file}': {e}")
+        return None
 
-        if new_workbook is None:
-            return None
+def find_chart_embeddings(ppt_zip):
+    """Map each chart part of the package to the embedded workbook part holding its data."""
+    names = set(ppt_zip.namelist())
+    chart_embeddings = {}
+    for name in names:
+        if not (name.startswith('ppt/charts/chart') and name.endswith('.xml')):
+            continue
+
+        rels_name = posixpath.join(posixpath.dirname(name), '_rels', posixpath.basename(name) + '.rels')
+        if rels_name not in names:
+            continue
+
+        external_data = etree.fromstring(ppt_zip.read(name)).find(f'{{{CHART_NS}}}externalData')
+        if external_data is None:
+            continue
+        rel_id = external_data.get(f'{{{REL_NS}}}id')
+
+        for relationship in etree.fromstring(ppt_zip.read(rels_name)).iter(f'{{{PKG_REL_NS}}}Relationship'):
+            if relationship.get('Id') == rel_id and relationship.get('TargetMode') != 'External':
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(name), relationship.get('Target')))
+                chart_embeddings[name] = target.lstrip('/')
+                break
+
+    return chart_embeddings
+
+def _data_extent(rows):
+    """Return the last non-empty row and column (1-based) of the copied rows."""
+    last_row = 0
+    last_col = 0
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, value in enumerate(row, start=1):
+            if value is not None:
+                last_row = row_idx
+                last_col = max(last_col, col_idx)
+    return last_row, last_col
+
+def _cell_value(rows, row_idx, col_idx):
+    """Return the copied value at the given 1-based position, or None outside the range."""
+    if row_idx > len(rows):
+        return None
+    row = rows[row_idx - 1]
+    return row[col_idx - 1] if col_idx <= len(row) else None
 
-        # Save the new workbook to memory
-        new_workbook_io = io.BytesIO()
-        new_workbook.save(new_workbook_io)
-        new_workbook_io.seek(0)  # Move cursor back to the beginning of the stream
+def _cache_number(value):
+    """Convert a cell value to the text stored in a c:numCache point, or None if not numeric."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if hasattr(value, 'year'):  # datetime/date values are cached as Excel serials
+        return repr(float(to_excel(value)))
+    return None
+
+def _cache_text(value):
+    """Convert a cell value to the text stored in a c:strCache point."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
 
-        return embedded_file, new_workbook_io.read()  # Return new workbook content
+def _rebuild_cache(ref, cache_tag, cache_children):
+    """Replace the cache of a chart reference with a new one holding cache_children, keeping its position."""
+    old_cache = ref.find(cache_tag)
+    # The cache sits between c:f and c:extLst (e.g. c15:fullRef on filtered series)
+    cache_index = ref.index(ref.find(f'{{{CHART_NS}}}f')) + 1
+    if old_cache is not None:
+        cache_index = ref.index(old_cache)
+        ref.remove(old_cache)
+
+    cache = etree.Element(cache_tag)
+    ref.insert(cache_index, cache)
+    cache.extend(cache_children)
+    return cache
+
+def _cache_points(values, to_text):
+    """c:pt elements of the values that have a cached text, indexed by their position."""
+    points = []
+    for idx, value in enumerate(values):
+        text = to_text(value) if value is not None else None
+        if text is None:
+            continue
+        point = etree.Element(f'{{{CHART_NS}}}pt')
+        point.set('idx', str(idx))
+        etree.SubElement(point, f'{{{CHART_NS}}}v').text = text
+        points.append(point)
+    return points
+
+def refresh_chart_cache(chart_xml, sheet_name, rows):
+    """
+    Rewrite the cached series of a chart part from the rows copied into its embedded workbook.
+    Single-column and single-row ranges (and the rows of multi-level category ranges) are resized
+    to the extent of the new data so that added or removed categories show up without PowerPoint
+    recomputing the chart. Ranges of filtered series (with a c15:fullRef) keep their address, so
+    the categories filtered out in PowerPoint stay hidden.
+    Returns the new chart XML, or None if no range of the chart points at the embedded sheet.
+    """
+    root = etree.fromstring(chart_xml)
+    last_row, last_col = _data_extent(rows)
+    updated = False
+
+    for ref in root.iter(f'{{{CHART_NS}}}numRef', f'{{{CHART_NS}}}strRef', f'{{{CHART_NS}}}multiLvlStrRef'):
+        formula = ref.find(f'{{{CHART_NS}}}f')
+        if formula is None or formula.text is None:
+            continue
+        match = CHART_REF_PATTERN.match(formula.text.strip())
+        if not match:
+            continue
+
+        sheet_prefix, start_col, start_row, end_col, end_row = match.groups()
+        ref_sheet = sheet_prefix[:-1]
+        if ref_sheet.startswith("'"):
+            ref_sheet = ref_sheet[1:-1].replace("''", "'")
+        if ref_sheet != sheet_name:
+            continue
+
+        start_col = column_index_from_string(start_col)
+        start_row = int(start_row)
+        end_col = column_index_from_string(end_col) if end_col else start_col
+        end_row = int(end_row) if end_row else start_row
+
+        is_multi_level = ref.tag == f'{{{CHART_NS}}}multiLvlStrRef'
+        # Resize series ranges to the new data, single cells (series names) and the ranges of
+        # filtered series (which would no longer match their c15:sqref) keep their address
+        if ref.find(f'.//{{{C15_NS}}}fullRef') is None:
+            if (start_col == end_col or is_multi_level) and start_row != end_row:
+                end_row = max(last_row, start_row)
+            elif start_row == end_row and start_col != end_col:
+                end_col = max(last_col, start_col)
+
+        start = f"${get_column_letter(start_col)}${start_row}"
+        end = f"${get_column_letter(end_col)}${end_row}"
+        formula.text = f"{sheet_prefix}{start}" if start == end else f"{sheet_prefix}{start}:{end}"
+
+        if is_multi_level:
+            # One c:lvl per column of the range, the innermost (last) column first; outer levels
+            # only have points on the rows where a label starts
+            point_count = etree.Element(f'{{{CHART_NS}}}ptCount')
+            point_count.set('val', str(end_row - start_row + 1))
+            levels = []
+            for col_idx in range(end_col, start_col - 1, -1):
+                level = etree.Element(f'{{{CHART_NS}}}lvl')
+                level.extend(_cache_points([_cell_value(rows, row_idx, col_idx) for row_idx in range(start_row, end_row + 1)],
+                                           _cache_text))
+                levels.append(level)
+            _rebuild_cache(ref, f'{{{CHART_NS}}}multiLvlStrCache', [point_count] + levels)
+            updated = True
+            continue
+
+        values = [_cell_value(rows, row_idx, col_idx)
+                  for row_idx in range(start_row, end_row + 1)
+                  for col_idx in range(start_col, end_col + 1)]
+
+        is_numeric = ref.tag == f'{{{CHART_NS}}}numRef'
+        cache_tag = f'{{{CHART_NS}}}numCache' if is_numeric else f'{{{CHART_NS}}}strCache'
+        children = []
+        if is_numeric:
+            format_code = etree.Element(f'{{{CHART_NS}}}formatCode')
+            format_code.text = ref.findtext(f'{{{CHART_NS}}}numCache/{{{CHART_NS}}}formatCode') or "General"
+            children.append(format_code)
+        point_count = etree.Element(f'{{{CHART_NS}}}ptCount')
+        point_count.set('val', str(len(values)))
+        children.append(point_count)
+        children += _cache_points(values, _cache_number if is_numeric else _cache_text)
+        _rebuild_cache(ref, cache_tag, children)
+
+        updated = True
+
+    if not updated:
+        return None
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+def build_marker_index(embeddings, chart_embeddings, mapping):
+    """
+    Join the markers found in the embedded workbooks with the marker ranges of the source workbook.
+    embeddings maps each embedded workbook part to its sheet name and marker, chart_embeddings
+    each chart part to its embedded workbook part (see find_chart_embeddings).
+    Returns, per marker, its range in the source workbook ('range', None if the workbook has no
+    such marker) and the embedded workbooks using it with the charts they feed ('embeddings').
+    """
+    charts_by_embedding = {}
+    for chart_part, embedded_part in chart_embeddings.items():
+        charts_by_embedding.setdefault(embedded_part, []).append(chart_part)
+
+    marker_index = {}
+    for embedded_part, embedding in sorted(embeddings.items()):
+        entry = marker_index.setdefault(embedding["marker"], {"range": mapping.get(embedding["marker"]), "embeddings": []})
+        entry["embeddings"].append({
+            "part": embedded_part,
+            "sheet_name": embedding["sheet_name"],
+            "charts": sorted(charts_by_embedding.get(embedded_part, [])),
+        })
+    return marker_index
+
+def render_part(task, state):
+    """
+    Build the new content of one package part.
+    task is ("embedding", part name, (embedded sheet name, marker name)) or
+    ("text", part name, placeholder segments or the part content). state holds the rows of
+    each marker ('marker_rows'), the sheets by title ('sheets') and, when the rows of a marker
+    are not in marker_rows yet, the 'workbook' and 'mapping' to read them from.
+    Returns (part name, new content, (embedded sheet name, marker name) or None), or None if
+    the part is left untouched.
+    """
+    kind, part_name, payload = task
+    try:
+        if kind == "embedding":
+            embedded_sheet_name, marker_name = payload
+            marker_rows = state["marker_rows"]
+            if marker_name not in marker_rows:
+                marker_rows[marker_name] = get_marker_rows(state["workbook"], state["mapping"], marker_name)
+            rows = marker_rows[marker_name]
+            if rows is None:
+                return None
+            return part_name, encode_embedded_workbook(embedded_sheet_name, rows), payload
+
+        segments = split_placeholders(payload) if isinstance(payload, bytes) else payload
+        if len(segments) == 1:  # Parts without placeholders are copied as they are
+            return None
+        return part_name, render_segments(segments, state["sheets"]).encode('utf-8'), None
 
     except Exception as e:
-        print(f"Failed to modify '{embedded_file}': {e}")
+        print(f"Failed to modify '{part_name}': {e}")
         return None
 
-def modify_embedded_excel_in_pptx(config):
-    """Modify embedded Excel files in the PowerPoint presentation based on the provided mapping."""
+def _timed_render_part(task, state):
+    """Run render_part and return its result with its duration, recorded by the parent process."""
+    start_time = time.perf_counter()
+    result = render_part(task, state)
+    return result, time.perf_counter() - start_time
+
+def process_pool_context():
+    """
+    Multiprocessing context of the worker pools. Pools are started from server request threads,
+    and forking a multithreaded process can leave the workers waiting on locks held by other
+    threads, so workers come from a fork server (started once, with the render modules already
+    imported so new workers start quickly) or are spawned where there is none.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["ppt_workbook_update", "pipeline"])
+        return context
+    return multiprocessing.get_context("spawn")
+
+# Worker pools shared by the renders of this process, by number of workers (see shared_process_pool)
+_shared_pools = {}
+_shared_pools_lock = threading.Lock()
+
+def shared_process_pool(workers):
+    """
+    Long-lived pool of workers processes, started on first use and reused by every later call with
+    the same number of workers, so a render does not pay for starting processes. Work sent to it
+    carries its own inputs or, for a batch, the path of a file holding them (see render_batch).
+    """
+    with _shared_pools_lock:
+        pool = _shared_pools.get(workers)
+        if pool is None:
+            pool = _shared_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=process_pool_context())
+        return pool
+
+def discard_process_pool(pool):
+    """Forget a shared pool that broke (e.g. a worker was killed for memory), the next call starts a new one."""
+    with _shared_pools_lock:
+        for workers, shared_pool in list(_shared_pools.items()):
+            if shared_pool is pool:
+                del _shared_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _slot_cells(segments, sheets):
+    """
+    The cells shown by the placeholder slots of a text part, as {sheet name: {cell reference: CellSnapshot}},
+    which is all a worker process needs to render it. Cells that cannot be read are left out, so
+    they fail the same way in the worker.
+    """
+    cells = {}
+    for sheet_name, cell_ref in segments[1::2]:
+        if sheet_name not in sheets:
+            continue  # Rendered as "Not found"
+        sheet_cells = cells.setdefault(sheet_name, {})
+        try:
+            cell = sheets[sheet_name][cell_ref]
+            sheet_cells[cell_ref] = CellSnapshot(cell.value, cell.number_format)
+        except Exception:
+            pass
+    return cells
+
+def _render_part_in_worker(task, marker_rows, sheets):
+    return _timed_render_part(task, {"marker_rows": marker_rows, "sheets": sheets})
+
+def _render_in_pool(pool, tasks, window, marker_rows, sheets):
+    """
+    Render tasks in the worker pool and yield their results in task order, with at most window
+    tasks submitted ahead of the result being consumed so rendered parts do not pile up.
+    Each task is sent with the rows of its marker or the cells of its placeholders.
+    """
+    pending = deque()
+    for task in tasks:
+        kind, _, payload = task
+        if kind == "embedding":
+            inputs = ({payload[1]: marker_rows[payload[1]]}, {})
+        else:
+            inputs = ({}, _slot_cells(payload, sheets))
+        pending.append(pool.submit(_render_part_in_worker, task, *inputs))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def _store_rendered_parts(tasks, results, updated_parts):
+    """
+    Put each rendered part into updated_parts as soon as it comes out of results, so that no more
+    than one of them is held outside of updated_parts (and its memory_limit) at a time.
+    Results come in task order, so the output does not depend on the number of workers.
+    """
+    for task, (result, seconds) in zip(tasks, results):
+        if result is not None:
+            part_name, content, _ = result
+            updated_parts[part_name] = content
+        instrumentation.record(f"{task[0]}_render", seconds, len(result[1]) if result is not None else 0)
+
+def _slot_inputs(segments, sheets):
+    """Raw value and number format of each placeholder slot of a slide, for its fingerprint."""
+    inputs = []
+    for segment in segments[1::2]:
+        sheet_name, cell_ref = segment
+        try:
+            cell = sheets[sheet_name][cell_ref]
+            inputs.append((sheet_name, cell_ref, cell.value, cell.number_format))
+        except Exception:
+            inputs.append((sheet_name, cell_ref, None, None))
+    return inputs
+
+def collect_updated_parts(ppt_zip, workbook, mapping, refresh_charts=True, template=None, workers=1,
+                          previous_fingerprints=None, fingerprints=None, updated_parts=None):
+    """
+    Build the new content of every package part that changes: the embedded workbooks,
+    the chart parts fed by them (when refresh_charts is set) and the slides, notes, layouts,
+    masters and charts with placeholders.
+    With a compiled deck template (see deck_template.py) the embeddings, charts and placeholders
+    are taken from the template instead of being rediscovered in the package.
+    With workers > 1 the embeddings and text parts are rendered by the shared pool of worker processes
+    (see shared_process_pool), each sent with the rows of its marker or the cells of its placeholders.
+    Each of these parts is fingerprinted from its inputs into the fingerprints dict (when given),
+    parts whose fingerprint equals the one in previous_fingerprints are not rendered again.
+    Returns a dict of part name to new bytes, or updated_parts filled with them when given
+    (e.g. a PartStore spilling them to disk).
+    """
+    previous_fingerprints = previous_fingerprints or {}
+    if fingerprints is None:
+        fingerprints = {}
+
+    if template is not None:
+        embeddings = template["embeddings"]
+        chart_embeddings = template["charts"]
+        text_tasks = [("text", part_name, segments) for part_name, segments in template["text_parts"].items()]
+    else:
+        embeddings = {}
+        text_tasks = []
+        for item in ppt_zip.infolist():
+            if item.filename.startswith('ppt/embeddings/') and item.filename.endswith('.xlsx'):
+                try:
+                    marker = read_embedded_marker(item.filename, ppt_zip.read(item.filename))
+                except Exception as e:
+                    print(f"Failed to modify '{item.filename}': {e}")
+                    marker = None
+                if marker is not None:
+                    embedded_sheet_name, marker_name = marker
+                    embeddings[item.filename] = {"sheet_name": embedded_sheet_name, "marker": marker_name}
+            elif TEXT_PART_PATTERN.match(item.filename):
+                try:
+                    segments = split_placeholders(ppt_zip.read(item.filename))
+                except Exception as e:
+                    print(f"Failed to modify '{item.filename}': {e}")
+                    continue
+                if len(segments) > 1:  # Parts without placeholders are copied as they are
+                    text_tasks.append(("text", item.filename, segments))
+        chart_embeddings = find_chart_embeddings(ppt_zip) if refresh_charts and embeddings else {}
+
+    # Only embeddings whose marker exists in the source workbook are regenerated
+    marker_index = build_marker_index(embeddings, chart_embeddings, mapping)
+    marker_rows = {}
+    tasks = []
+    for marker_name, entry in marker_index.items():
+        if entry["range"] is None:
+            print(f"Marker '{marker_name}' not found in the Excel mapping. Skipping chart.")
+            continue
+        marker_rows[marker_name] = get_marker_rows(workbook, mapping, marker_name)
+        for embedding in entry["embeddings"]:
+            tasks.append(("embedding", embedding["part"], (embedding["sheet_name"], marker_name)))
+    tasks.sort(key=lambda task: task[1])
+    tasks += text_tasks
+
+    # A part is rendered from its source member and the workbook values it shows
+    sheets = build_sheet_index(workbook)
+    for kind, part_name, payload in tasks:
+        source_crc = ppt_zip.getinfo(part_name).CRC
+        if kind == "embedding":
+            embedded_sheet_name, marker_name = payload
+            fingerprints[part_name] = fingerprint(source_crc, embedded_sheet_name, marker_rows[marker_name])
+        else:
+            fingerprints[part_name] = fingerprint(source_crc, _slot_inputs(payload, sheets))
+    chart_sources = {}
+    for kind, part_name, payload in tasks:
+        if kind == "embedding" and marker_rows[payload[1]] is not None:
+            chart_sources[part_name] = {"sheet_name": payload[0], "rows": marker_rows[payload[1]]}
+    if refresh_charts:
+        # A chart with placeholders in its title depends on both its cells and its embedded workbook
+        for chart_part, embedded_part in chart_embeddings.items():
+            if embedded_part in chart_sources:
+                fingerprints[chart_part] = fingerprint(ppt_zip.getinfo(chart_part).CRC, fingerprints[embedded_part],
+                                                       fingerprints.get(chart_part))
+
+    tasks = [task for task in tasks if previous_fingerprints.get(task[1]) != fingerprints[task[1]]]
+
+    if updated_parts is None:
+        updated_parts = {}
+    if workers > 1 and len(tasks) > 1:
+        pool = shared_process_pool(workers)
+        try:
+            _store_rendered_parts(tasks, _render_in_pool(pool, tasks, workers * 2, marker_rows, sheets), updated_parts)
+        except BrokenProcessPool:
+            discard_process_pool(pool)
+            raise
+    else:
+        state = {
+            "marker_rows": marker_rows,
+            "sheets": sheets,
+            "workbook": workbook,
+            "mapping": mapping,
+        }
+        _store_rendered_parts(tasks, (_timed_render_part(task, state) for task in tasks), updated_parts)
+
+    if refresh_charts:
+        for chart_part, embedded_part in chart_embeddings.items():
+            if chart_part not in fingerprints or previous_fingerprints.get(chart_part) == fingerprints[chart_part]:
+                continue
+            if embedded_part not in updated_parts and previous_fingerprints.get(embedded_part) != fingerprints[embedded_part]:
+                continue  # The embedded workbook could not be regenerated
+            try:
+                with instrumentation.stage("chart_refresh") as timed:
+                    chart_source = chart_sources[embedded_part]
+                    # On top of the substituted title when the chart also holds placeholders
+                    chart_xml = updated_parts.get(chart_part) or ppt_zip.read(chart_part)
+                    new_chart_xml = refresh_chart_cache(chart_xml, chart_source["sheet_name"], chart_source["rows"])
+                    if new_chart_xml is not None:
+                        updated_parts[chart_part] = new_chart_xml
+                        timed.bytes = len(new_chart_xml)
+            except Exception as e:
+                print(f"Failed to refresh chart cache of '{chart_part}': {e}")
+
+    # Parts left as in the source deck get no fingerprint, so they are rendered again next time
+    for part_name in [part_name for part_name, part_fingerprint in fingerprints.items()
+                      if part_name not in updated_parts and previous_fingerprints.get(part_name) != part_fingerprint]:
+        del fingerprints[part_name]
+
+    return updated_parts
+
+def write_updated_pptx(config, output):
+    """
+    Write the updated PowerPoint package straight to an output path or binary file object.
+    Takes the same config as modify_embedded_excel_in_pptx but does not build a Presentation,
+    and returns stats about the written package instead.
+    With 'previous_output' (an earlier output of the same deck), the parts whose inputs did not
+    change are copied byte for byte from it instead of being rendered again. The fingerprints of
+    the rendered parts are saved in a manifest next to output when it is a path.
+    'compression' sets how the changed members are compressed (see resolve_compression_policy),
+    they are compressed by up to 'compression_threads' threads.
+    With 'memory_limit' (bytes) at most that much rendered and compressed content is held in memory:
+    rendered parts beyond it are spilled to a temporary file and the changed members are compressed
+    in windows of half of it. Untouched members are always streamed in chunks, so memory use does
+    not grow with the size of the deck (only a single rendered part larger than the limit exceeds it).
+    """
     ppt_file_path = config['ppt_file_path']
     workbook = config['workbook']
     mapping = config['mapping']
-    use_filesystem = config.get('use_filesystem', False)
-    temp_dir = None
-    try:
-        if use_filesystem:
-            # Use unique temporary directory for filesystem processing
-            temp_dir = tempfile.mkdtemp()
-
-            with zipfile.ZipFile(ppt_file_path, 'r') as ppt_zip:
-                ppt_zip.extractall(temp_dir)
-
-                for item in ppt_zip.infolist():
-                    if item.filename.startswith('ppt/embeddings/') and item.filename.endswith('.xlsx'):
-                        embedded_path = os.path.join(temp_dir, item.filename)
-                        with open(embedded_path, 'rb') as f:
-                            embedded_content = f.read()
-                        result = process_embedded_workbook(item.filename, embedded_content, workbook, mapping)
-                        if result:
-                            embedded_filename, new_workbook_content = result
-                            with open(os.path.join(temp_dir, embedded_filename), 'wb') as f:
-                                f.write(new_workbook_content)
-
-                # Replace placeholders in slide XML files
-                slide_dir = os.path.join(temp_dir, 'ppt/slides')
-                if os.path.exists(slide_dir):
-                    for slide_file in os.listdir(slide_dir):
-                        slide_path = os.path.join(slide_dir, slide_file)
-                        if slide_file.endswith('.xml'):
-                            with open(slide_path, 'r', encoding='utf-8') as file:
-                                slide_content = file.read()
-
-                            updated_slide_content = replace_placeholders_in_slide_content(slide_content, workbook)
-
-                            with open(slide_path, 'w', encoding='utf-8') as file:
-                                file.write(updated_slide_content)
-
-            updated_ppt_io = io.BytesIO()
-            with zipfile.ZipFile(updated_ppt_io, 'w') as updated_ppt_zip:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, temp_dir)
-                        updated_ppt_zip.write(file_path, arcname)
-
-            updated_ppt_io.seek(0)
-
-            presentation = Presentation(updated_ppt_io)
-
+    refresh_charts = config.get('refresh_chart_cache', True)
+    template = config.get('template')
+    workers = config.get('workers', 1)
+    previous_output = config.get('previous_output')
+    compression_policy = resolve_compression_policy(config.get('compression'))
+    compression_threads = config.get('compression_threads', os.cpu_count() or 1)
+    memory_limit = config.get('memory_limit')
+
+    previous_zip = None
+    previous_fingerprints = {}
+    if previous_output:
+        try:
+            previous_zip = zipfile.ZipFile(previous_output, 'r')
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Previous output '{previous_output}' cannot be reused: {e}")
         else:
-            # Use in-memory zipping/unzipping
-            with zipfile.ZipFile(ppt_file_path, 'r') as ppt_zip:
-                updated_ppt_io = io.BytesIO()
-                updated_ppt_zip = zipfile.ZipFile(updated_ppt_io, 'w')
-
-                for item in ppt_zip.infolist():
-                    if item.filename.startswith('ppt/embeddings/') and item.filename.endswith('.xlsx'):
-                        embedded_content = ppt_zip.read(item.filename)
-                        result = process_embedded_workbook(item.filename, embedded_content, workbook, mapping)
-
-                        if result:
-                            embedded_filename, new_workbook_content = result
-                            updated_ppt_zip.writestr(embedded_filename, new_workbook_content)
-                        else:
-                            updated_ppt_zip.writestr(item.filename, embedded_content)
-                    elif item.filename.startswith('ppt/slides') and item.filename.endswith('.xml'):
-                        slide_content = ppt_zip.read(item.filename).decode('utf-8')
-                        updated_slide_content = replace_placeholders_in_slide_content(slide_content, workbook)
-                        updated_ppt_zip.writestr(item.filename, updated_slide_content.encode('utf-8'))
+            # A part is only reused if the previous output still holds what was rendered into it
+            # (a PowerPoint refresh rewrites the whole package)
+            previous_crcs = {item.filename: item.CRC for item in previous_zip.infolist()}
+            previous_fingerprints = {part_name: entry["fingerprint"] for part_name, entry in load_manifest(previous_output).items()
+                                     if previous_crcs.get(part_name) == entry["crc"]}
+
+    fingerprints = {}
+    manifest = {}
+    output_file = open(output, 'wb') if isinstance(output, (str, os.PathLike)) else output
+    updated_parts = PartStore(memory_limit)
+    try:
+        with zipfile.ZipFile(ppt_file_path, 'r') as ppt_zip:
+            collect_updated_parts(ppt_zip, workbook, mapping, refresh_charts, template, workers,
+                                  previous_fingerprints, fingerprints, updated_parts)
+
+            # Changed members are compressed a window at a time, just before they are written
+            members = ppt_zip.infolist()
+            windows = compression_windows([item.filename for item in members if item.filename in updated_parts],
+                                          {part_name: updated_parts.size(part_name) for part_name in updated_parts},
+                                          memory_limit)
+            window_index = {part_name: index for index, window in enumerate(windows) for part_name in window}
+            compressed_parts = {}
+
+            # Untouched members (media, fonts, layouts...) are copied without recompression
+            with instrumentation.stage("zip_write") as timed, PackageWriter(output_file) as updated_ppt_zip:
+                for item in members:
+                    if item.filename in updated_parts:
+                        if item.filename not in compressed_parts:
+                            window = windows[window_index[item.filename]]
+                            with instrumentation.stage("compress", sum(map(updated_parts.size, window)), len(window)):
+                                compressed_parts = compress_members({part_name: updated_parts[part_name] for part_name in window},
+                                                                    compression_policy, compression_threads)
+                        updated_ppt_zip.write_compressed_member(item, compressed_parts[item.filename])
+                        manifest[item.filename] = compressed_parts[item.filename][1]
+                    elif item.filename in fingerprints:
+                        previous_item = previous_zip.getinfo(item.filename)
+                        updated_ppt_zip.copy_member(previous_zip.fp, previous_item)
+                        manifest[item.filename] = previous_item.CRC
                     else:
-                        updated_ppt_zip.writestr(item.filename, ppt_zip.read(item.filename))
-
-                updated_ppt_zip.close()
-                updated_ppt_io.seek(0)
-
-                presentation = Presentation(updated_ppt_io)
+                        updated_ppt_zip.copy_member(ppt_zip.fp, item)
+                timed.bytes = updated_ppt_zip.bytes_written
+                timed.count = len(members)
+            changed_parts = sorted(updated_parts)
+            spilled_parts = updated_parts.spilled_parts
+    finally:
+        updated_parts.close()
+        if output_file is not output:
+            output_file.close()
+        if previous_zip is not None:
+            previous_zip.close()
+
+    if output_file is not output:
+        save_manifest(output, {part_name: {"fingerprint": fingerprints[part_name], "crc": crc}
+                               for part_name, crc in manifest.items()})
+
+    return {
+        "changed_parts": changed_parts,
+        "parts_changed": updated_ppt_zip.parts_changed,
+        "parts_copied": updated_ppt_zip.parts_copied,
+        "parts_reused": len(manifest) - len(changed_parts),
+        "parts_spilled": spilled_parts,
+        "touched_charts": [part_name for part_name in changed_parts if part_name.startswith('ppt/charts/')],
+        "touched_slides": [part_name for part_name in changed_parts if part_name.startswith('ppt/slides/')],
+        "bytes_written": updated_ppt_zip.bytes_written,
+    }
 
+def modify_embedded_excel_in_pptx(config):
+    """
+    Modify embedded Excel files in the PowerPoint presentation based on the provided mapping.
+    Unless 'refresh_chart_cache' is set to False, the cached series of the charts are rebuilt
+    from the new data so the deck no longer needs a PowerPoint refresh (refreshCharts).
+    Optional keys: 'template' (compiled deck template) and 'workers' (render processes, default 1).
+    The updated package is written to a temporary file with 'use_filesystem', or to a buffer
+    spilling to disk past 'memory_limit' bytes (see write_updated_pptx), before it is opened.
+    """
+    use_filesystem = config.get('use_filesystem', False)
+    memory_limit = config.get('memory_limit')
+    if use_filesystem:
+        updated_ppt_io = tempfile.TemporaryFile(prefix='powerpoint_')
+    elif memory_limit:
+        updated_ppt_io = tempfile.SpooledTemporaryFile(max_size=memory_limit, prefix='powerpoint_')
+    else:
+        updated_ppt_io = io.BytesIO()
+    try:
+        write_updated_pptx(config, updated_ppt_io)
+        updated_ppt_io.seek(0)
+        presentation = Presentation(updated_ppt_io)
     except Exception as e:
         print(f"An error occurred: {e}")
         raise
     finally:
-        # Clean up the temporary directory if it was used
-        if temp_dir and os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
+        updated_ppt_io.close()
 
     return presentation
 
@@ -204,46 +746,87 @@ def get_excel_value(sheet, cell_ref):
 def format_value(value, number_format):
     """
     Format the value according to the Excel cell's number format.
-    - Retain Excel's significant digits and percentage formatting.
-    - Always format numbers over 1 million with "M".
+    - Number formats are compiled once (see number_format.py) and show what Excel shows.
     """
     if value is None:
         return " "  # Return a space instead of "N/A"
 
-    # Handle numbers over 1 million, format them with "M"
-    if isinstance(value, (int, float)) and value >= 1_000_000:
-        return f"{value / 1_000_000:.1f}M"
-
-    # Handle percentage formats based on Excel formatting
-    if "0%" in number_format or "percent" in number_format.lower():
-        decimals = number_format.split(".")[1].count("0") if "." in number_format else 0
-        return f"{value * 100:.{decimals}f}%"
-
-    # Handle significant digits based on Excel's formatting
-    if isinstance(value, (int, float)):
-        if number_format == "General":
-            return str(value)
-        elif "0." in number_format:
-            decimals = number_format.split(".")[1].count("0")  # Count decimal places
-            return f"{value:.{decimals}f}"
-        elif number_format.startswith("#,##0"):
-            return f"{value:,.0f}"
-        elif number_format == "0":
-            return f"{int(value)}"
-
-    return str(value)
+    return compile_number_format(number_format)(value)
 
-def replace_placeholders_in_slide_content(slide_content, workbook):
-    """Replace placeholders in the slide content using a regex."""
-    sheets = {sheet.title: sheet for sheet in workbook}
-    placeholder_pattern = re.compile(r'\[\[([A-Za-z0-9_ ]+?)!(\w+)\]\]')
-
-    def replace_placeholder(match):
-        sheet_name, cell_ref = match.groups()
+def split_placeholders(content):
+    """
+    Split the XML of a part (bytes or str) into literal segments and [sheet name, cell reference]
+    placeholder slots. Literal segments and slots alternate, starting and ending with a
+    (possibly empty) literal.
+    Placeholders are looked for in the text of each paragraph, so one that PowerPoint split over
+    several runs is found too: its slot goes where it starts and its text is removed from the
+    other runs. The content is scanned once, only paragraphs holding a '[' are looked at.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+
+    # (start, end, slot) of the content cut out, slot is None for the rest of a split placeholder
+    cuts = []
+    for paragraph in PARAGRAPH_PATTERN.finditer(content):
+        if content.find(b'[', paragraph.start(), paragraph.end()) == -1:
+            continue
+        runs = [(text.start(1), text.end(1)) for text in TEXT_PATTERN.finditer(content, paragraph.start(), paragraph.end())]
+        offsets = []
+        length = 0
+        for start, end in runs:
+            offsets.append(length)
+            length += end - start
+        paragraph_text = b"".join(content[start:end] for start, end in runs)
+
+        for match in PLACEHOLDER_BYTES_PATTERN.finditer(paragraph_text):
+            slot = [match.group(1).decode('utf-8'), match.group(2).decode('utf-8')]
+            run_index = bisect_right(offsets, match.start()) - 1
+            while run_index < len(runs) and offsets[run_index] < match.end():
+                start, end = runs[run_index]
+                cut_start = start + max(match.start() - offsets[run_index], 0)
+                cut_end = start + min(match.end() - offsets[run_index], end - start)
+                if cut_end > cut_start or slot is not None:
+                    cuts.append((cut_start, cut_end, slot))
+                slot = None
+                run_index += 1
+
+    segments = []
+    literal = []
+    position = 0
+    for start, end, slot in cuts:
+        literal.append(content[position:start])
+        position = end
+        if slot is not None:
+            segments.append(b"".join(literal).decode('utf-8'))
+            segments.append(slot)
+            literal = []
+    literal.append(content[position:])
+    segments.append(b"".join(literal).decode('utf-8'))
+    return segments
+
+def render_segments(segments, sheets):
+    """Join the segments of a part, replacing each placeholder slot by its Excel value escaped for XML."""
+    parts = []
+    for segment in segments:
+        if isinstance(segment, str):
+            parts.append(segment)
+            continue
+        sheet_name, cell_ref = segment
         if sheet_name in sheets:
-            return get_excel_value(sheets[sheet_name], cell_ref)
-        return "Not found"
+            parts.append(escape(get_excel_value(sheets[sheet_name], cell_ref)))
+        else:
+            parts.append("Not found")
+    return "".join(parts)
 
-    updated_content = placeholder_pattern.sub(replace_placeholder, slide_content)
-    return updated_content
+def build_sheet_index(workbook):
+    """Sheets of a workbook by title, built once per job and shared by every part rendered."""
+    return {sheet.title: sheet for sheet in workbook}
 
+def replace_placeholders_in_slide_content(slide_content, workbook, sheets=None):
+    """
+    Replace the placeholders of a slide (or notes, layout or chart XML) with their Excel values.
+    Pass sheets (see build_sheet_index) when rendering several parts from the same workbook.
+    """
+    if sheets is None:
+        sheets = build_sheet_index(workbook)
+    return render_segments(split_placeholders(slide_content), sheets)
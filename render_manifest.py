@@ -0,0 +1,40 @@
+import hashlib
+import json
+import os
+
+# Bumped whenever the rendering of a part changes, so parts of older outputs are not reused
+MANIFEST_VERSION = 3
+
+
+def fingerprint(*inputs):
+    """Hash of the inputs a rendered part depends on (source member CRC, marker rows, cell values...)."""
+    return hashlib.sha256(repr(inputs).encode('utf-8')).hexdigest()
+
+
+def manifest_path(output_path):
+    """Path of the manifest kept next to a rendered deck."""
+    return f"{output_path}.manifest.json"
+
+
+def load_manifest(output_path):
+    """
+    Return {part name: {"fingerprint", "crc"}} of the parts rendered into output_path,
+    or an empty dict when there is no usable manifest for it.
+    """
+    try:
+        with open(manifest_path(output_path), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("parts", {})
+
+
+def save_manifest(output_path, parts):
+    """Write the manifest of a rendered deck, replacing the previous one atomically."""
+    path = manifest_path(output_path)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({"version": MANIFEST_VERSION, "parts": parts}, f, sort_keys=True)
+    os.replace(temp_path, path)
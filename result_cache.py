@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from render_manifest import manifest_path
+
+# Bump whenever rendering changes, so outputs cached by an older version are not served again
+RESULT_CACHE_VERSION = 2
+
+# Written last in an entry directory, an entry without it is incomplete or not reusable
+META_FILE = "meta.json"
+# Staging directories older than this (seconds) belong to crashed computations
+STALE_STAGING_AGE = 3600
+
+
+def make_cache_key(file_hashes, options):
+    """
+    Content-addressed key of a set of input files, given by their SHA-256 hex digests (see
+    deck_template.hash_file, computed once per upload and reused by the stages), and processing options.
+    """
+    digest = hashlib.sha256()
+    for file_hash in file_hashes:
+        digest.update(file_hash.encode('ascii'))
+    digest.update(json.dumps({**options, "version": RESULT_CACHE_VERSION}, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _link_or_copy(source, path):
+    """Make source available under path, hard-linked when possible. Returns False when it cannot be."""
+    try:
+        os.link(source, path)
+    except FileExistsError:
+        pass
+    except OSError:
+        try:
+            shutil.copyfile(source, path)
+        except OSError:
+            return False
+    return True
+
+
+class ResultCache:
+    """
+    Disk-backed cache of finished output files, one directory per key under root.
+    Entries are evicted least recently used first once their total size exceeds max_bytes, and
+    concurrent requests for the same key share a single computation.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key, filename):
+        """Return the cached output for key, available under filename, and its metadata, or None."""
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        path = os.path.join(entry_dir, filename)
+        if not os.path.exists(path):
+            # Same content uploaded under another name, link the output under the requested name,
+            # with its manifest so it can be passed as previous_filename like the original
+            source = os.path.join(entry_dir, meta["filename"])
+            if not _link_or_copy(source, path):
+                return None
+            if os.path.exists(manifest_path(source)):
+                _link_or_copy(manifest_path(source), manifest_path(path))
+
+        os.utime(entry_dir)  # Mark the entry as recently used
+        return path, meta
+
+    def get_or_compute(self, key, filename, compute):
+        """
+        Return (path, meta, hit) for key, running compute(output_path) on a miss.
+        compute writes the output file and returns a JSON-serializable dict stored as the entry
+        metadata, the entry is only reused by later requests if that dict has no 'cacheable': False.
+        """
+        cached = self.lookup(key, filename)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+
+        if not owner:
+            path, meta = future.result()
+            if os.path.basename(path) != filename:
+                cached = self.lookup(key, filename)
+                if cached is not None:
+                    path, meta = cached
+            return path, meta, True
+
+        try:
+            path, meta = self._compute(key, filename, compute)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result((path, meta))
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+        self.evict()
+        return path, meta, False
+
+    def _compute(self, key, filename, compute):
+        os.makedirs(self.root, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.root)
+        try:
+            meta = dict(compute(os.path.join(staging_dir, filename)) or {})
+            meta["filename"] = filename
+            meta["created"] = time.time()
+            if meta.get("cacheable", True):
+                with open(os.path.join(staging_dir, META_FILE), 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+
+            entry_dir = self._entry_dir(key)
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(staging_dir, entry_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        return os.path.join(entry_dir, filename), meta
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        for name in names:
+            entry_dir = os.path.join(self.root, name)
+            if name.endswith(".tmp"):
+                # Staging directory, left behind if the process died while computing
+                if time.time() - os.path.getmtime(entry_dir) > STALE_STAGING_AGE:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            if not os.path.isdir(entry_dir):
+                continue
+            # Output files linked under several names share their inode and are counted once
+            inodes = {}
+            try:
+                for file in os.scandir(entry_dir):
+                    stat = file.stat()
+                    inodes[stat.st_ino] = stat.st_size
+                last_used = os.path.getmtime(entry_dir)
+            except OSError:
+                continue  # Replaced or evicted concurrently
+            size = sum(inodes.values())
+            entries.append((last_used, name, entry_dir, size))
+            total += size
+
+        for _, name, entry_dir, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            with self._lock:
+                if name in self._inflight:
+                    continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            print(f"Evicted cached result {name} ({size} bytes)")
+            total -= size
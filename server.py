@@ -1,22 +1,85 @@
+import functools
 import urllib.parse
-from flask import Flask, request, send_file, jsonify, render_template_string
+from flask import Flask, Request, Response, g, request, send_file, jsonify, render_template_string
+import cProfile
 import os
 import time
 import traceback
 import tempfile
 import shutil
-from threading import Thread
+from threading import Lock, Thread
 from waitress import serve
-from ppt_workbook_update import analyze_excel_markers, modify_embedded_excel_in_pptx
-from refreshCharts import refreshCharts, vba_code  # only works on Windows and will not work with Linux or Mac
-from openpyxl import load_workbook
+import async_frontend
+import instrumentation
+from pipeline import render_deck, refresh_deck
+from jobs import JobManager, QueueFull
+from result_cache import ResultCache, make_cache_key
+from batch import stream_batch_zip
+from deck_template import hash_file
+from workbook_cache import WorkbookCache
+from analysis import analyze_deck
+from admission import AdmissionController, Lane, Saturated, count_embeddings, estimate_cost
+
+# Uploads up to this size stay in memory while the request is parsed, larger ones spill to a temporary file
+UPLOAD_SPOOL_BYTES = int(os.environ.get('PPT_UPLOAD_SPOOL_MB', 32)) * 1024 * 1024
+# Larger request bodies are refused with a 413, 0 for no limit
+MAX_REQUEST_BYTES = int(os.environ.get('PPT_MAX_REQUEST_MB', 1024)) * 1024 * 1024 or None
+
+
+class SpooledRequest(Request):
+    """Request whose uploaded files are read into size-bounded spooled buffers."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return async_frontend.spooled_buffer(UPLOAD_SPOOL_BYTES)
+
+    def _load_form_data(self):
+        # The asyncio front end splits multipart bodies into spooled files as they arrive, use those
+        form_data = self.environ.get(async_frontend.FORM_DATA_KEY)
+        if form_data is None or "form" in self.__dict__:
+            return super()._load_form_data()
+        fields, files = form_data
+        self.__dict__["form"] = self.parameter_storage_class(fields)
+        self.__dict__["files"] = self.parameter_storage_class(files)
+
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+# Behind a proxy that serves files itself (mod_xsendfile, lighttpd), /download only sends an X-Sendfile header
+app.use_x_sendfile = os.environ.get('PPT_USE_X_SENDFILE') == '1'
 
 # Directory where temporary files will be stored
 TEMP_ROOT = os.path.join(os.getcwd(), 'temp')
+# Compiled deck templates, kept across requests (not cleaned up with the temp directories)
+TEMPLATE_CACHE_DIR = os.path.join(os.getcwd(), 'template_cache')
 LOCK_FILE = "powerpoint_process.lock"
 
+# Processes used by /upload to render the embedded workbooks and slides of a deck in parallel
+RENDER_WORKERS = int(os.environ.get('PPT_RENDER_WORKERS', 1))
+
+# Background jobs (/jobs): number of render worker processes and maximum number of unfinished jobs
+JOB_WORKERS = int(os.environ.get('PPT_JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('PPT_JOB_QUEUE_SIZE', 20))
+# Finished outputs of /upload, reused for identical deck/workbook/options (served by /download like temp dirs)
+RESULT_CACHE_DIR = os.path.join(TEMP_ROOT, 'powerpoint_cache')
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('PPT_RESULT_CACHE_MB', 2048)) * 1024 * 1024
+# Loaded workbooks (snapshot and markers) by content hash, so a workbook uploaded again skips openpyxl
+WORKBOOK_CACHE_PATH = os.path.join(TEMP_ROOT, 'powerpoint_workbooks.sqlite3')
+WORKBOOK_CACHE_MAX_BYTES = int(os.environ.get('PPT_WORKBOOK_CACHE_MB', 512)) * 1024 * 1024
+# Processes used by /batch to render the decks of a batch in parallel
+BATCH_WORKERS = int(os.environ.get('PPT_BATCH_WORKERS', 2))
+# Compression preset of the changed members of /upload outputs: stored, fast, default or max
+OUTPUT_COMPRESSION = os.environ.get('PPT_OUTPUT_COMPRESSION')
+# Rendered content an /upload render holds in memory before spilling to disk, 0 for no limit
+RENDER_MEMORY_LIMIT = int(os.environ.get('PPT_RENDER_MEMORY_MB', 64)) * 1024 * 1024 or None
+# Requests sent with ?profile=1 are profiled with cProfile into this directory, when it is set
+PROFILE_DIR = os.environ.get('PPT_PROFILE_DIR')
+# How long a job refresh waits for the PowerPoint lock held by /upload before giving up
+REFRESH_LOCK_WAIT = 300
+# Serve from the asyncio front end (see async_frontend.py) instead of waitress: slow uploads and
+# downloads then hold a connection but no thread, PPT_SERVER_THREADS only run the application
+ASYNC_FRONTEND = os.environ.get('PPT_ASYNC_FRONTEND') == '1'
+
 # HTML content rendered directly via Flask (for testing only, prod is using bodhi vue)
 index_html = """
 <!DOCTYPE html>
@@ -96,16 +159,70 @@ def remove_lock():
     if os.path.exists(LOCK_FILE):
         os.remove(LOCK_FILE)
 
+def wait_for_lock(timeout):
+    """Wait until the PowerPoint lock is free, for up to timeout seconds. Returns False if it is still held."""
+    wait_start = time.time()
+    while is_locked():
+        if time.time() - wait_start > timeout:
+            return False
+        time.sleep(1)
+    return True
+
+def refresh_when_unlocked(output_ppt_file):
+    """Refresh the deck of a job once PowerPoint is free, holding the lock file like /upload does."""
+    if not wait_for_lock(REFRESH_LOCK_WAIT):
+        return "PowerPoint stayed busy, the chart refresh was not run. You can run the macro by yourself."
+    create_lock()
+    try:
+        return refresh_deck(output_ppt_file)
+    finally:
+        remove_lock()
+
+# Services of the server, built by init_services in the serving process only: the worker processes
+# of the render pools import this module again as __mp_main__ and must not open caches or start pools
+result_cache = None
+workbook_cache = None
+admission = None
+# Jobs submitted to /jobs, rendered by worker processes, refreshed one at a time
+job_manager = None
+_services_lock = Lock()
+
+def init_services():
+    """Build the caches, admission lanes and job manager on first use. Safe to call more than once."""
+    global result_cache, workbook_cache, admission, job_manager
+    with _services_lock:
+        if job_manager is not None:
+            return
+        result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+        workbook_cache = WorkbookCache(WORKBOOK_CACHE_PATH, WORKBOOK_CACHE_MAX_BYTES)
+        # Lanes of /upload and /batch work (see admission.py): requests running at once, waiting at most,
+        # and how long one may wait. Renders estimated under PPT_FAST_LANE_MAX_COST seconds take the fast lane
+        admission = AdmissionController(
+            fast=Lane("fast", int(os.environ.get('PPT_FAST_LANE_CONCURRENCY', 4)), int(os.environ.get('PPT_FAST_LANE_QUEUE', 16)),
+                      max_wait=30, expected_seconds=0.5),
+            bulk=Lane("bulk", int(os.environ.get('PPT_BULK_LANE_CONCURRENCY', 2)), int(os.environ.get('PPT_BULK_LANE_QUEUE', 4)),
+                      max_wait=120, expected_seconds=10),
+            refresh=Lane("refresh", 1, int(os.environ.get('PPT_REFRESH_LANE_QUEUE', 4)), max_wait=REFRESH_LOCK_WAIT,
+                         expected_seconds=30),
+            fast_max_cost=float(os.environ.get('PPT_FAST_LANE_MAX_COST', 2)))
+        job_manager = JobManager(workers=JOB_WORKERS, max_pending=JOB_QUEUE_SIZE, refresh=refresh_when_unlocked,
+                                 workbook_cache=workbook_cache)
+
 def clean_old_temp_dirs():
     """
     Routine to clean up temporary directories older than 5 minute.
     """
     while True:
         now = time.time()
+        job_manager.prune(5 * 60)
+        active_job_dirs = job_manager.active_dirs()
         for temp_dir in os.listdir(TEMP_ROOT):
             temp_dir_path = os.path.join(TEMP_ROOT, temp_dir)
-            # Check if it is a directory and get its age
-            if os.path.isdir(temp_dir_path):
+            # Check if it is a directory and get its age, directories of unfinished jobs are kept
+            # The result cache evicts its own entries
+            if temp_dir_path == RESULT_CACHE_DIR:
+                continue
+            if os.path.isdir(temp_dir_path) and temp_dir_path not in active_job_dirs:
                 dir_age = now - os.path.getmtime(temp_dir_path)
                 if dir_age > 5 * 60:  # Older than 5 minutes
                     try:
@@ -115,98 +232,324 @@ def clean_old_temp_dirs():
                         print(f"Error removing {temp_dir_path}: {e}")
         time.sleep(30)  # Check every 30 seconds
 
+@app.before_request
+def start_request_trace():
+    """Collect the stages run by the request, and profile it when asked to."""
+    init_services()
+    g.request_start = time.perf_counter()
+    g.trace = instrumentation.Trace()
+    g.trace_token = instrumentation.start(g.trace)
+    if PROFILE_DIR and request.args.get('profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def add_server_timing(response):
+    """Report the stages of the request in a Server-Timing header and in the /metrics histograms."""
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Only the request thread is profiled, renders running in worker processes are not
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_name = f"{time.strftime('%Y%m%d-%H%M%S')}_{request.endpoint}_{os.getpid()}_{id(profiler)}.prof"
+        profiler.dump_stats(os.path.join(PROFILE_DIR, profile_name))
+        response.headers['X-Profile-File'] = profile_name
+
+    total = time.perf_counter() - g.request_start
+    server_timing = g.trace.server_timing()
+    response.headers['Server-Timing'] = f"{server_timing}, total;dur={total * 1000:.1f}" if server_timing else f"total;dur={total * 1000:.1f}"
+    instrumentation.metrics.observe_stages(g.trace.stages)
+    instrumentation.metrics.observe_request(request.endpoint or "unknown", response.status_code, total)
+    return response
+
+@app.teardown_request
+def end_request_trace(exception):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        instrumentation.finish(token)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage and request metrics in the Prometheus text format."""
+    return Response(instrumentation.metrics.render() + admission.render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     """Render the HTML form."""
     return render_template_string(index_html)
+class PowerPointBusy(Exception):
+    """Raised when a refresh is requested while another request holds the PowerPoint lock."""
+
+def saturated_response(message, retry_after):
+    """503 response asking the client to retry after the given number of seconds."""
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
 @app.route('/upload', methods=['POST'])
 def upload_and_process():
     print("first in route")
     """Handle the file upload and process the files."""
-    skip_macro = request.form.get('skip_macro') == 'true'  # Retrieve the skip_macro value
-    if not skip_macro:
-        if is_locked():
-            print("file was lock")
-            return jsonify({"error": "Another process is currently using PowerPoint. Please try again later or use the skip macro option."}), 400
-        # Create lock to ensure exclusive access if macro is not skipped
-        create_lock()
-
-    if 'ppt_file' not in request.files or 'excel_file' not in request.files:
-        return jsonify({"error": "Please upload both PowerPoint and Excel files"}), 400
+    # The uploads are parsed into spooled buffers (see SpooledRequest) that are read in place,
+    # the only file written is the output, in the result cache served by /download
+    with instrumentation.stage("upload_receive", bytes=request.content_length or 0) as timed:
+        timed.count = len(request.files)  # Parses the multipart body, inside the timed stage
+        if 'ppt_file' not in request.files or 'excel_file' not in request.files:
+            return jsonify({"error": "Please upload both PowerPoint and Excel files"}), 400
 
     ppt_file = request.files['ppt_file']
     excel_file = request.files['excel_file']
     skip_macro = request.form.get('skip_macro') == 'true'  # Retrieve the skip_macro value
     print("skip_macro is ", skip_macro)
-    # Create temporary directories to store uploaded files and output
-    temp_dir = tempfile.mkdtemp(prefix='powerpoint_', dir=TEMP_ROOT)
+    # Optional output of an earlier upload of the same deck (the filename it returned): the parts
+    # whose Excel values did not change are reused from it
+    previous_output = None
+    previous_filename = request.form.get('previous_filename')
+    if previous_filename:
+        previous_output = os.path.normpath(os.path.join(TEMP_ROOT, previous_filename))
+        if not previous_filename.startswith('powerpoint_') or not previous_output.startswith(TEMP_ROOT + os.sep):
+            return jsonify({"error": "Invalid previous filename"}), 400
+        if not os.path.exists(previous_output):
+            previous_output = None
+    # Requests are sent to a lane by estimated cost, so cheap renders do not wait behind refreshes
+    cost = estimate_cost(request.content_length or 0, count_embeddings(ppt_file.stream), not skip_macro)
+    lane = admission.lane_for(cost, not skip_macro)
     try:
-        # Save uploaded PowerPoint and Excel files to the temporary directory
-        ppt_file_path = os.path.join(temp_dir, ppt_file.filename)
-        excel_file_path = os.path.join(temp_dir, excel_file.filename)
-        ppt_file.save(ppt_file_path)
-        excel_file.save(excel_file_path)
-
-        # Load the Excel workbook once
-        workbook = load_workbook(excel_file_path, data_only=True, read_only=True)
-
-        # Output file path for the modified PowerPoint
+        # Output file name for the modified PowerPoint
         updated_filename = ppt_file.filename.replace('.ppt', '_updated.ppt') # this is to handle both pptx and pptm
-        output_ppt_file = os.path.join(temp_dir, updated_filename)
-        
-        # Configuration dictionary for modifying embedded Excel files
-        config_modify = {
-            "use_filesystem": False,
-            'ppt_file_path': ppt_file_path,
-            'workbook': workbook,
-            'mapping': analyze_excel_markers(workbook)
-        }
 
-        # Modify embedded Excel files in the PowerPoint based on the marker mapping
-        presentation = modify_embedded_excel_in_pptx(config_modify)
+        def compute(output_ppt_file):
+            with lane.admit():
+                return render_and_refresh(output_ppt_file)
+
+        def render_and_refresh(output_ppt_file):
+            if not skip_macro:
+                # The refresh lane runs one request at a time, the lock may still be held by a job or batch
+                if not wait_for_lock(REFRESH_LOCK_WAIT):
+                    print("file was lock")
+                    raise PowerPointBusy()
+                # Create lock to ensure exclusive access if macro is not skipped
+                create_lock()
+            try:
+                stats = render_deck(ppt_file.stream, excel_file.stream, output_ppt_file, TEMPLATE_CACHE_DIR, RENDER_WORKERS,
+                                    previous_output, OUTPUT_COMPRESSION, RENDER_MEMORY_LIMIT, workbook_cache,
+                                    deck_hash=deck_hash, workbook_hash=workbook_hash)
+                instrumentation.merge(stats["stages"])
 
-        # Save the modified presentation to the output file path
-        with open(output_ppt_file, 'wb') as output_file:
-            presentation.save(output_file)
+                if not skip_macro:
+                    error_message = refresh_deck(output_ppt_file)
+                else:
+                    print("Skipping macro as requested.")
+                    error_message = None
+            finally:
+                # Remove lock to allow other processes if macro was not skipped
+                if not skip_macro:
+                    remove_lock()
 
-        workbook.close() # Explicitly delete the workbook to release the file handle
+            # Decks whose refresh failed are not reused, the next identical request tries again
+            return {"refresh_error": error_message, "cacheable": error_message is None,
+                    "touched_charts": stats["touched_charts"], "touched_slides": stats["touched_slides"]}
 
-        if not skip_macro:
-            try:
-                print("before refreshing")
-                refreshCharts(output_ppt_file)  # window only
-            except Exception as e:
-                print(f"refreshCharts failed: {e}")
-                # Add a header indicating refreshCharts failure
-                error_message = f"The chart refresh is incomplete. The workbook for the chart has been updated, but the chart cache could not be recomputed. You can manually refresh the chart clicking on 'I will run the macro myself' and run the macro by yourself" # you could add {urllib.parse.quote(vba_code)}
-                print("error_message", error_message)
-            else:
-                error_message = None
-        else:
-            print("Skipping macro as requested.")
-            error_message = None
+        # Identical deck, workbook and options give the same output: serve it from the result cache.
+        # The uploads are hashed once here, the template and workbook caches reuse the digests
+        with instrumentation.stage("upload_hash", bytes=request.content_length or 0, count=2):
+            deck_hash = hash_file(ppt_file.stream)
+            workbook_hash = hash_file(excel_file.stream)
+        cache_key = make_cache_key([deck_hash, workbook_hash], {"skip_macro": skip_macro, "compression": OUTPUT_COMPRESSION})
+        output_ppt_file, meta, hit = result_cache.get_or_compute(cache_key, updated_filename, compute)
+        if hit:
+            print(f"Served cached result {cache_key}")
 
         # Send the relative path to the client for download
         relative_file_path = os.path.relpath(output_ppt_file, TEMP_ROOT)
-        return jsonify({"filename": relative_file_path})
-    
+        # Charts and slides rendered by this request, nothing was rendered for a cached result
+        return jsonify({
+            "filename": relative_file_path,
+            "touched_charts": [] if hit else meta["touched_charts"],
+            "touched_slides": [] if hit else meta["touched_slides"],
+        })
+
+    except Saturated as e:
+        return saturated_response(f"The server is busy ({e.lane} lane), please try again later.", e.retry_after)
+
+    except PowerPointBusy:
+        return saturated_response("Another process is currently using PowerPoint. Please try again later or use the skip macro option.",
+                                  admission.refresh.retry_after())
+
     except Exception as e:
         error_trace = traceback.format_exc()
         print("error ", error_trace)
         # Optionally, you can log the error_trace somewhere (e.g., to a file or a logging service)
         return jsonify({"error": str(e), "stack": error_trace}), 500
-    
+
     finally:
-        # Remove lock to allow other processes if macro was not skipped
+        print("end")
+
+@app.route('/analyze', methods=['POST'])
+def analyze():
+    """
+    Check a deck against an Excel file without rendering it: marker matches and row ranges,
+    unresolved placeholders, unused markers and the estimated cost and lane of an /upload.
+    """
+    if 'ppt_file' not in request.files or 'excel_file' not in request.files:
+        return jsonify({"error": "Please upload both PowerPoint and Excel files"}), 400
+
+    ppt_file = request.files['ppt_file']
+    excel_file = request.files['excel_file']
+    skip_macro = request.form.get('skip_macro') == 'true'
+    try:
+        with instrumentation.stage("analysis", bytes=request.content_length or 0):
+            report = analyze_deck(ppt_file.stream, excel_file.stream, TEMPLATE_CACHE_DIR, refresh=not skip_macro)
+    except Exception as e:
+        # Unreadable packages are the user's files, not a server error
+        return jsonify({"error": f"Could not analyze the files: {e}"}), 400
+
+    # Same estimate /upload uses to pick its lane
+    cost = estimate_cost(request.content_length or 0, count_embeddings(ppt_file.stream), not skip_macro)
+    report["estimated_cost"]["lane"] = admission.lane_for(cost, not skip_macro).name
+    return jsonify(report)
+
+@app.route('/batch', methods=['POST'])
+def batch_process():
+    """
+    Update several decks (ppt_files) from one Excel file and stream back a ZIP of the updated decks,
+    each added as soon as it is rendered, with batch_report.json listing the errors of failed decks.
+    """
+    ppt_files = request.files.getlist('ppt_files')
+    if not ppt_files or 'excel_file' not in request.files:
+        return jsonify({"error": "Please upload an Excel file and at least one PowerPoint file"}), 400
+
+    excel_file = request.files['excel_file']
+    skip_macro = request.form.get('skip_macro') == 'true'
+
+    # A batch holds a bulk (or refresh) lane slot until its ZIP is sent
+    lane = admission.refresh if not skip_macro else admission.bulk
+    try:
+        lane.acquire()
+    except Saturated as e:
+        return saturated_response(f"The server is busy ({e.lane} lane), please try again later.", e.retry_after)
+    lane_start = time.perf_counter()
+
+    temp_dir = tempfile.mkdtemp(prefix='powerpoint_', dir=TEMP_ROOT)
+    locked = False
+    try:
+        # Each deck gets its own directory so decks uploaded under the same name do not collide
+        ppt_file_paths = []
+        with instrumentation.stage("upload_save", count=len(ppt_files) + 1) as timed:
+            for index, ppt_file in enumerate(ppt_files):
+                deck_dir = os.path.join(temp_dir, f"deck_{index}")
+                os.makedirs(deck_dir)
+                ppt_file_path = os.path.join(deck_dir, ppt_file.filename)
+                ppt_file.save(ppt_file_path)
+                ppt_file_paths.append(ppt_file_path)
+            excel_file_path = os.path.join(temp_dir, excel_file.filename)
+            excel_file.save(excel_file_path)
+            timed.bytes = sum(os.path.getsize(path) for path in ppt_file_paths + [excel_file_path])
+        output_dir = os.path.join(temp_dir, 'output')
+        os.makedirs(output_dir)
+
         if not skip_macro:
+            if not wait_for_lock(REFRESH_LOCK_WAIT):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                lane.release()
+                return saturated_response("Another process is currently using PowerPoint. Please try again later or use the skip macro option.",
+                                          lane.retry_after())
+            # PowerPoint is held for the whole batch, each deck is refreshed once it is rendered
+            create_lock()
+            locked = True
+
+        chunks = stream_batch_zip(ppt_file_paths, excel_file_path, output_dir, TEMPLATE_CACHE_DIR, BATCH_WORKERS,
+                                  refresh=None if skip_macro else refresh_deck, workbook_cache=workbook_cache)
+    except Exception as e:
+        if locked:
             remove_lock()
-            # Don't remove temp_dir immediately to allow download
-            print("end")
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        lane.release()
+        error_trace = traceback.format_exc()
+        print("error ", error_trace)
+        return jsonify({"error": str(e), "stack": error_trace}), 500
+
+    def generate():
+        try:
+            yield from chunks
+        finally:
+            # Also runs when the client disconnects before the end of the batch
+            if locked:
+                remove_lock()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    response = Response(generate(), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename="batch_results.zip"'
+    # Runs even when the response is closed before generate() was started
+    response.call_on_close(lambda: lane.release(time.perf_counter() - lane_start))
+    return response
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue the processing of the uploaded files and return the job id right away."""
+    if 'ppt_file' not in request.files or 'excel_file' not in request.files:
+        return jsonify({"error": "Please upload both PowerPoint and Excel files"}), 400
+
+    ppt_file = request.files['ppt_file']
+    excel_file = request.files['excel_file']
+    skip_macro = request.form.get('skip_macro') == 'true'
+
+    temp_dir = tempfile.mkdtemp(prefix='powerpoint_', dir=TEMP_ROOT)
+    ppt_file_path = os.path.join(temp_dir, ppt_file.filename)
+    excel_file_path = os.path.join(temp_dir, excel_file.filename)
+    with instrumentation.stage("upload_save", count=2) as timed:
+        ppt_file.save(ppt_file_path)
+        excel_file.save(excel_file_path)
+        timed.bytes = os.path.getsize(ppt_file_path) + os.path.getsize(excel_file_path)
+
+    updated_filename = ppt_file.filename.replace('.ppt', '_updated.ppt') # this is to handle both pptx and pptm
+    output_ppt_file = os.path.join(temp_dir, updated_filename)
+
+    try:
+        job_id = job_manager.submit(ppt_file_path, excel_file_path, output_ppt_file, TEMPLATE_CACHE_DIR,
+                                    refresh=not skip_macro, temp_dir=temp_dir)
+    except QueueFull as e:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        response = jsonify({"error": f"The server is busy, please try again later ({e})."})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Return the status of a job, with the file name to download once it is done."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    result = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "timings": job["timings"],
+        "error": job["error"],
+        "refresh_error": job["refresh_error"],
+    }
+    if job["status"] == "done":
+        result["filename"] = os.path.relpath(job["output_ppt_file"], TEMP_ROOT)
+        result["stats"] = job["stats"]
+    return jsonify(result)
+
+@functools.lru_cache(maxsize=256)
+def _content_etag(file_path, size, mtime_ns):
+    """SHA-256 of an output file, hashed once per version of the file (size and mtime are part of the key)."""
+    return hash_file(file_path)
 
 @app.route('/download', methods=['GET'])
 def download_file():
     print("in download")
-    """Provide the generated file for download."""
+    """
+    Provide the generated file for download. The file is sent with a strong ETag (its SHA-256):
+    If-None-Match gets a 304, and Range / If-Range requests get the requested bytes so an
+    interrupted download can resume.
+    """
     filename = request.args.get('filename')
     if not filename:
         return jsonify({"error": "Filename is required"}), 400
@@ -215,19 +558,35 @@ def download_file():
         print("filename not matching pattern", filename)
         return jsonify({"error": "Invalid filename"}), 400
     # Path to the file in the temp directory
-    file_path = os.path.join(TEMP_ROOT, filename)
-    if not os.path.exists(file_path):
+    file_path = os.path.normpath(os.path.join(TEMP_ROOT, filename))
+    if not file_path.startswith(TEMP_ROOT + os.sep):
+        return jsonify({"error": "Invalid filename"}), 400
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
         return jsonify({"error": "File not found"}), 404
 
-    return send_file(file_path, as_attachment=True, download_name=filename)
+    etag = _content_etag(file_path, file_stat.st_size, file_stat.st_mtime_ns)
+    response = send_file(file_path, as_attachment=True, download_name=filename,
+                         conditional=True, etag=etag, last_modified=file_stat.st_mtime)
+    # Cached copies are checked with If-None-Match before they are reused, which costs a 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 if __name__ == '__main__':
     # Ensure TEMP_ROOT exists
     os.makedirs(TEMP_ROOT, exist_ok=True)
+    init_services()
+    # Waitress threads: every request a lane can hold gets one, with some left for downloads and status polls
+    server_threads = int(os.environ.get('PPT_SERVER_THREADS', admission.capacity() + 4))
 
     # Start the cleanup thread to remove old temp directories
     cleanup_thread = Thread(target=clean_old_temp_dirs, daemon=True)
     cleanup_thread.start()
 
     # Run Flask using Waitress server on port 8000
-    serve(app, host='0.0.0.0', port=8000)
+    if ASYNC_FRONTEND:
+        async_frontend.serve(app, host='0.0.0.0', port=8000, threads=server_threads,
+                             max_body_bytes=MAX_REQUEST_BYTES, spool_bytes=UPLOAD_SPOOL_BYTES)
+    else:
+        serve(app, host='0.0.0.0', port=8000, threads=server_threads)
@@ -0,0 +1,152 @@
+import hashlib
+import http.client
+import io
+import json
+import re
+import socket
+import threading
+import time
+
+import pytest
+from flask import Flask, request, send_file
+from werkzeug.datastructures import FileStorage
+from werkzeug.test import encode_multipart
+
+import async_frontend
+
+MAX_BODY_BYTES = 64 * 1024
+SPOOL_BYTES = 1024
+FILE_CONTENT = bytes(range(256)) * 64
+
+
+def _app(file_path):
+    app = Flask(__name__)
+
+    @app.route('/echo', methods=['GET', 'POST'])
+    def echo():
+        return request.get_data()
+
+    @app.route('/form', methods=['POST'])
+    def form():
+        fields, files = request.environ[async_frontend.FORM_DATA_KEY]
+        return json.dumps({"fields": dict(fields),
+                           "files": {name: hashlib.sha256(file.read()).hexdigest() for name, file in files}})
+
+    @app.route('/file')
+    def file():
+        return send_file(file_path, conditional=True)
+
+    return app
+
+
+@pytest.fixture(scope="module")
+def port(tmp_path_factory):
+    file_path = tmp_path_factory.mktemp("frontend") / "content.bin"
+    file_path.write_bytes(FILE_CONTENT)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    threading.Thread(target=async_frontend.serve, args=(_app(str(file_path)), "127.0.0.1", port, 2),
+                     kwargs={"max_body_bytes": MAX_BODY_BYTES, "spool_bytes": SPOOL_BYTES}, daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return port
+
+
+def _exchange(port, raw):
+    """Send raw bytes and read everything the server sends until it closes the connection."""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as connection:
+        connection.sendall(raw)
+        received = b""
+        while chunk := connection.recv(65536):
+            received += chunk
+    return received
+
+
+def _status_lines(response):
+    # A pipelined response starts right after the body of the previous one, not on a line of its own
+    return re.findall(rb"HTTP/1\.1 \d{3} [^\r]*", response)
+
+
+def _chunked(body, size):
+    return b"".join(b"%x\r\n%s\r\n" % (len(body[i:i + size]), body[i:i + size])
+                    for i in range(0, len(body), size)) + b"0\r\n\r\n"
+
+
+def test_chunked_body_is_reassembled(port):
+    body = FILE_CONTENT[:5000]
+    response = _exchange(port, b"POST /echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+                         + _chunked(body, 777))
+    assert _status_lines(response) == [b"HTTP/1.1 200 OK"]
+    assert response.endswith(b"\r\n\r\n" + body)
+
+
+def test_multipart_files_spilled_to_disk_are_complete(port):
+    boundary, body = encode_multipart({"name": "deck", "deck": FileStorage(io.BytesIO(FILE_CONTENT), "deck.pptx"),
+                                       "small": FileStorage(io.BytesIO(b"tiny"), "small.bin")})
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("POST", "/form", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    response = connection.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read()) == {
+        "fields": {"name": "deck"},
+        "files": {"deck": hashlib.sha256(FILE_CONTENT).hexdigest(), "small": hashlib.sha256(b"tiny").hexdigest()},
+    }
+
+
+@pytest.mark.parametrize("head", [
+    b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % (MAX_BODY_BYTES + 1),
+    b"POST /echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n%x\r\n" % (MAX_BODY_BYTES + 1),
+])
+def test_oversized_body_is_refused_before_it_is_read(port, head):
+    response = _exchange(port, head)
+    assert _status_lines(response) == [b"HTTP/1.1 413 Content Too Large"]
+    assert b"Connection: close" in response
+
+
+def test_keep_alive_reuses_the_connection(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    for body in (b"first", b"second"):
+        connection.request("POST", "/echo", body)
+        response = connection.getresponse()
+        assert response.getheader("Connection") == "keep-alive"
+        assert response.read() == body
+    connection.close()
+
+
+def test_pipelined_requests_are_answered_in_order(port):
+    response = _exchange(port, b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\none"
+                               b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\ntwo"
+                               b"GET /echo HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    assert _status_lines(response) == [b"HTTP/1.1 200 OK"] * 3
+    assert response.index(b"\r\n\r\none") < response.index(b"\r\n\r\ntwo")
+
+
+@pytest.mark.parametrize("raw", [
+    b"GET /echo\r\nHost: x\r\n\r\n",
+    b"GET /echo HTTP/1.1\r\nHost x\r\n\r\n",
+    b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: ten\r\n\r\n",
+    b"POST /echo HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n",
+])
+def test_malformed_request_is_refused(port, raw):
+    response = _exchange(port, raw)
+    assert _status_lines(response) == [b"HTTP/1.1 400 Bad Request"]
+
+
+def test_file_response_is_sent_whole(port):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", "/file")
+    response = connection.getresponse()
+    assert response.status == 200
+    assert response.read() == FILE_CONTENT
+    # The connection stays usable after a sendfile response
+    connection.request("GET", "/file", headers={"Range": "bytes=1000-1999"})
+    response = connection.getresponse()
+    assert response.status == 206
+    assert response.getheader("Content-Range") == f"bytes 1000-1999/{len(FILE_CONTENT)}"
+    assert response.read() == FILE_CONTENT[1000:2000]
+    connection.close()
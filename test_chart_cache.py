@@ -0,0 +1,67 @@
+from lxml import etree
+
+from ppt_workbook_update import C15_NS, CHART_NS, refresh_chart_cache
+
+FILTERED_SERIES_CHART = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<c:chartSpace xmlns:c="{CHART_NS}" xmlns:c15="{C15_NS}">
+  <c:chart><c:plotArea><c:barChart><c:ser>
+    <c:cat><c:strRef>
+      <c:f>Sheet1!$A$2:$A$3</c:f>
+      <c:strCache><c:ptCount val="2"/><c:pt idx="0"><c:v>a</c:v></c:pt><c:pt idx="1"><c:v>b</c:v></c:pt></c:strCache>
+      <c:extLst><c:ext uri="{{02D57815-91ED-43cb-92C2-25804820EDAC}}"><c15:fullRef><c15:sqref>Sheet1!$A$2:$A$4</c15:sqref></c15:fullRef></c:ext></c:extLst>
+    </c:strRef></c:cat>
+    <c:val><c:numRef>
+      <c:f>Sheet1!$B$2:$B$3</c:f>
+      <c:extLst><c:ext uri="{{02D57815-91ED-43cb-92C2-25804820EDAC}}"><c15:fullRef><c15:sqref>Sheet1!$B$2:$B$4</c15:sqref></c15:fullRef></c:ext></c:extLst>
+    </c:numRef></c:val>
+  </c:ser></c:barChart></c:plotArea></c:chart>
+</c:chartSpace>""".encode("utf-8")
+
+MULTI_LEVEL_CHART = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<c:chartSpace xmlns:c="{CHART_NS}">
+  <c:chart><c:plotArea><c:barChart><c:ser>
+    <c:cat><c:multiLvlStrRef>
+      <c:f>Sheet1!$A$2:$B$3</c:f>
+      <c:multiLvlStrCache><c:ptCount val="2"/><c:lvl><c:pt idx="0"><c:v>old</c:v></c:pt></c:lvl></c:multiLvlStrCache>
+    </c:multiLvlStrRef></c:cat>
+    <c:val><c:numRef><c:f>Sheet1!$C$2:$C$3</c:f></c:numRef></c:val>
+  </c:ser></c:barChart></c:plotArea></c:chart>
+</c:chartSpace>""".encode("utf-8")
+
+
+def _child_names(ref):
+    return [etree.QName(child).localname for child in ref]
+
+
+def _values(element):
+    return [v.text for v in element.iter(f"{{{CHART_NS}}}v")]
+
+
+def test_refresh_keeps_filtered_ranges_and_cache_before_ext_lst():
+    rows = [("Name", "Value"), ("x", 1), ("y", 2), ("z", 3)]
+    root = etree.fromstring(refresh_chart_cache(FILTERED_SERIES_CHART, "Sheet1", rows))
+
+    str_ref = root.find(f".//{{{CHART_NS}}}strRef")
+    num_ref = root.find(f".//{{{CHART_NS}}}numRef")
+    assert _child_names(str_ref) == ["f", "strCache", "extLst"]
+    assert _child_names(num_ref) == ["f", "numCache", "extLst"]
+
+    # The rows filtered out in PowerPoint stay hidden, c:f still matches c15:sqref
+    assert num_ref.findtext(f"{{{CHART_NS}}}f") == "Sheet1!$B$2:$B$3"
+    assert num_ref.findtext(f".//{{{C15_NS}}}sqref") == "Sheet1!$B$2:$B$4"
+    assert _values(num_ref.find(f"{{{CHART_NS}}}numCache")) == ["1", "2"]
+    assert _values(str_ref.find(f"{{{CHART_NS}}}strCache")) == ["x", "y"]
+
+
+def test_refresh_rebuilds_multi_level_category_cache():
+    rows = [("Region", "City", "Sales"), ("North", "Oslo", 1), (None, "Bergen", 2), ("South", "Rome", 3)]
+    root = etree.fromstring(refresh_chart_cache(MULTI_LEVEL_CHART, "Sheet1", rows))
+
+    ref = root.find(f".//{{{CHART_NS}}}multiLvlStrRef")
+    assert ref.findtext(f"{{{CHART_NS}}}f") == "Sheet1!$A$2:$B$4"
+    cache = ref.find(f"{{{CHART_NS}}}multiLvlStrCache")
+    assert cache.find(f"{{{CHART_NS}}}ptCount").get("val") == "3"
+    inner, outer = cache.findall(f"{{{CHART_NS}}}lvl")
+    assert _values(inner) == ["Oslo", "Bergen", "Rome"]
+    assert [pt.get("idx") for pt in outer] == ["0", "2"]
+    assert _values(outer) == ["North", "South"]
@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+from number_format import compile_number_format
+from ppt_workbook_update import format_value
+
+CASES = [
+    # Thousands separators and scaling commas
+    ("#,##0", 1234567, "1,234,567"),
+    ("#,##0", -1234.6, "-1,235"),
+    ("#,##0.00", 1234.5, "1,234.50"),
+    ("#,##0,", 1234567, "1,235"),
+    ("0.0,,", 12345678, "12.3"),
+    # Rounding, percentages and scientific notation
+    ("0.00", 0.005, "0.01"),
+    ("0.0%", 0.1234, "12.3%"),
+    ("0.00E+00", 12345, "1.23E+04"),
+    # Currency and literal text
+    ('"$"#,##0.00', 1234.5, "$1,234.50"),
+    ("[$€-407]#,##0.00", 1234.5, "€1,234.50"),
+    ('0.0" kg"', 3.14, "3.1 kg"),
+    ('@" units"', "ten", "ten units"),
+    # Negative and zero sections, colors
+    ("#,##0;(#,##0)", -1234, "(1,234)"),
+    ('#,##0;(#,##0);"-"', 0, "-"),
+    ('0.00;-0.00;"zero"', 0, "zero"),
+    ("0;[Red]-0", -5, "-5"),
+    ("[Blue]0;[Color10]-0", -5, "-5"),
+    ("0.00;;;@", -2, ""),
+    # Dates and times, from date values and from serial numbers
+    ("yyyy-mm-dd", datetime.datetime(2024, 3, 5), "2024-03-05"),
+    ("yyyy-mm-dd", 45356, "2024-03-05"),
+    ("dd/mm/yyyy", datetime.datetime(2024, 3, 5), "05/03/2024"),
+    ("d mmm yyyy", datetime.date(2024, 3, 5), "5 Mar 2024"),
+    ("h:mm AM/PM", datetime.datetime(2024, 3, 5, 14, 7), "2:07 PM"),
+    ("hh:mm:ss", datetime.time(9, 5, 3), "09:05:03"),
+    ("mm:ss.0", datetime.time(0, 1, 2, 300000), "01:02.3"),
+    ("[h]:mm", datetime.timedelta(hours=27, minutes=5), "27:05"),
+    # Constructs that are not implemented show the value as General
+    ("# ?/?", 1.5, "1.5"),
+    ("[DBNum1]0", 5, "5"),
+]
+
+
+@pytest.mark.parametrize("number_format, value, expected", CASES)
+def test_compile_number_format(number_format, value, expected):
+    assert compile_number_format(number_format)(value) == expected
+
+
+@pytest.mark.parametrize("number_format, expected", [
+    ("#,##0", "1,234,567"),
+    ("0.00", "1234567.00"),
+    ("General", "1234567"),
+])
+def test_format_value_large_numbers_follow_the_cell_format(number_format, expected):
+    assert format_value(1234567, number_format) == expected
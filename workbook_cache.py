@@ -0,0 +1,82 @@
+import contextlib
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+
+# Bump when WorkbookSnapshot or the marker mapping change layout so stale entries are loaded again
+WORKBOOK_CACHE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workbooks (
+    hash TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+
+
+class WorkbookCache:
+    """
+    SQLite cache of loaded workbooks: the WorkbookSnapshot and marker mapping of each workbook,
+    keyed by the SHA-256 of its content, so a workbook uploaded again skips openpyxl entirely.
+    Entries are evicted least recently used first once their total size exceeds max_bytes.
+    Only the path is kept between calls, so the cache can be handed to worker processes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @contextlib.contextmanager
+    def _connect(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(SCHEMA)
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, workbook_hash):
+        """Return (snapshot, mapping) of a workbook by content hash, or None when it is not cached."""
+        try:
+            with self._connect() as connection:
+                row = connection.execute("SELECT data FROM workbooks WHERE hash = ? AND version = ?",
+                                         (workbook_hash, WORKBOOK_CACHE_VERSION)).fetchone()
+                if row is None:
+                    return None
+                connection.execute("UPDATE workbooks SET last_used = ? WHERE hash = ?", (time.time(), workbook_hash))
+            return pickle.loads(zlib.decompress(row[0]))
+        except Exception as e:
+            print(f"Ignoring unreadable workbook cache entry '{workbook_hash}': {e}")
+            return None
+
+    def put(self, workbook_hash, snapshot, mapping):
+        """Store the snapshot and mapping of a workbook, then evict entries beyond max_bytes."""
+        data = zlib.compress(pickle.dumps((snapshot, mapping), protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > self.max_bytes:
+            return
+        try:
+            with self._connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO workbooks (hash, version, data, size, last_used) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   (workbook_hash, WORKBOOK_CACHE_VERSION, data, len(data), time.time()))
+                self._evict(connection)
+        except sqlite3.Error as e:
+            print(f"Failed to cache workbook '{workbook_hash}': {e}")
+
+    def _evict(self, connection):
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM workbooks").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for workbook_hash, size in connection.execute("SELECT hash, size FROM workbooks ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM workbooks WHERE hash = ?", (workbook_hash,))
+            total -= size
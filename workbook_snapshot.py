@@ -0,0 +1,169 @@
+from array import array
+from collections import namedtuple
+from itertools import chain, repeat
+from openpyxl import load_workbook
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+
+# Cell-like view returned by SheetSnapshot lookups, mirrors the openpyxl attributes we use
+CellSnapshot = namedtuple("CellSnapshot", ["value", "number_format"])
+
+
+class SheetSnapshot:
+    """
+    Column-oriented copy of a worksheet: one list of values and one array of number format ids
+    per column, all padded to the same number of rows.
+    Gives O(1) cell access and cheap row-range slicing, and mimics the parts of the openpyxl
+    worksheet API used by ppt_workbook_update (title, sheet['B2'], iter_rows).
+    A sheet loaded from row_offset + 1 on (see load_workbook_selection) reads the rows above as empty.
+    """
+
+    def __init__(self, title, number_formats, row_offset=0):
+        self.title = title
+        self.columns = []
+        self.format_ids = []
+        self.row_offset = row_offset
+        self.max_row = row_offset
+        self._number_formats = number_formats
+
+    @property
+    def max_column(self):
+        return len(self.columns)
+
+    def append_row(self, values, format_ids):
+        """Append one row, widening the sheet when the row is longer than the previous ones."""
+        loaded_rows = self.max_row - self.row_offset
+        while len(self.columns) < len(values):
+            self.columns.append([None] * loaded_rows)
+            self.format_ids.append(array("H", bytes(2 * loaded_rows)))
+        for col_idx in range(len(self.columns)):
+            if col_idx < len(values):
+                self.columns[col_idx].append(values[col_idx])
+                self.format_ids[col_idx].append(format_ids[col_idx])
+            else:
+                self.columns[col_idx].append(None)
+                self.format_ids[col_idx].append(0)
+        self.max_row += 1
+
+    def cell(self, row, column):
+        """Return the value and number format of a cell (1-based row and column)."""
+        if row <= self.row_offset or column < 1 or row > self.max_row or column > len(self.columns):
+            return CellSnapshot(None, "General")
+        index = row - self.row_offset - 1
+        return CellSnapshot(self.columns[column - 1][index],
+                            self._number_formats[self.format_ids[column - 1][index]])
+
+    def __getitem__(self, cell_ref):
+        column_letter, row = coordinate_from_string(cell_ref)
+        return self.cell(row, column_index_from_string(column_letter))
+
+    def iter_rows(self, min_row=None, max_row=None, min_col=None, max_col=None, values_only=False):
+        """Yield rows as tuples, like Worksheet.iter_rows on a read-only workbook."""
+        first_row = (min_row or 1) - 1
+        last_row = min(max_row or self.max_row, self.max_row)
+        first_col = (min_col or 1) - 1
+        last_col = min(max_col or len(self.columns), len(self.columns))
+        if first_row >= last_row or first_col >= last_col:
+            return iter(())
+
+        # Rows above row_offset were not loaded, they are given as empty
+        empty_rows = max(min(self.row_offset, last_row) - first_row, 0)
+        first_row = max(first_row - self.row_offset, 0)
+        last_row = max(last_row - self.row_offset, 0)
+        if empty_rows:
+            empty_cell = None if values_only else CellSnapshot(None, "General")
+            empty_rows = repeat((empty_cell,) * (last_col - first_col), empty_rows)
+
+        value_columns = [column[first_row:last_row] for column in self.columns[first_col:last_col]]
+        if values_only:
+            rows = zip(*value_columns)
+        else:
+            number_formats = self._number_formats
+            format_columns = [[number_formats[format_id] for format_id in format_ids[first_row:last_row]]
+                              for format_ids in self.format_ids[first_col:last_col]]
+            rows = (tuple(CellSnapshot(value, number_format) for value, number_format in zip(values, formats))
+                    for values, formats in zip(zip(*value_columns), zip(*format_columns)))
+        return chain(empty_rows, rows) if empty_rows else rows
+
+
+class WorkbookSnapshot:
+    """In-memory snapshot of a workbook, usable wherever the pipeline expects an openpyxl workbook."""
+
+    def __init__(self):
+        self.worksheets = []
+        self._sheets = {}
+        # Number formats are interned, format id 0 is always "General"
+        self.number_formats = ["General"]
+        self._format_ids = {"General": 0}
+
+    @property
+    def sheetnames(self):
+        return [sheet.title for sheet in self.worksheets]
+
+    def format_id(self, number_format):
+        """Return the interned id of a number format, registering it on first use."""
+        if number_format is None:
+            return 0
+        format_id = self._format_ids.get(number_format)
+        if format_id is None:
+            format_id = len(self.number_formats)
+            self.number_formats.append(number_format)
+            self._format_ids[number_format] = format_id
+        return format_id
+
+    def add_sheet(self, sheet):
+        self.worksheets.append(sheet)
+        self._sheets[sheet.title] = sheet
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheets:
+            raise KeyError(f"Worksheet {sheet_name} does not exist.")
+        return self._sheets[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._sheets
+
+    def __iter__(self):
+        return iter(self.worksheets)
+
+    def close(self):
+        """Nothing to release, the snapshot does not keep the source file open."""
+
+
+def load_workbook_snapshot(filename):
+    """Read every sheet of a workbook once and return a WorkbookSnapshot of its values and formats."""
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    snapshot = WorkbookSnapshot()
+    try:
+        for worksheet in workbook.worksheets:
+            sheet = SheetSnapshot(worksheet.title, snapshot.number_formats)
+            for row in worksheet.iter_rows():
+                sheet.append_row([cell.value for cell in row],
+                                  [snapshot.format_id(cell.number_format) for cell in row])
+            snapshot.add_sheet(sheet)
+    finally:
+        workbook.close()
+    return snapshot
+
+
+def load_workbook_selection(filename, row_spans):
+    """
+    Return a WorkbookSnapshot of only some rows of some sheets: row_spans maps a sheet name to the
+    (first row, last row) to read, other sheets are not parsed and rows past the span are not read.
+    A span whose last row is before its first one gives an empty sheet.
+    """
+    workbook = load_workbook(filename, read_only=True, data_only=True)
+    snapshot = WorkbookSnapshot()
+    try:
+        for worksheet in workbook.worksheets:
+            if worksheet.title not in row_spans:
+                continue
+            first_row, last_row = row_spans[worksheet.title]
+            sheet = SheetSnapshot(worksheet.title, snapshot.number_formats, first_row - 1)
+            rows = worksheet.iter_rows(min_row=first_row, max_row=last_row) if last_row >= first_row else ()
+            for row in rows:
+                sheet.append_row([cell.value for cell in row],
+                                 [snapshot.format_id(cell.number_format) for cell in row])
+            snapshot.add_sheet(sheet)
+    finally:
+        workbook.close()
+    return snapshot
@@ -0,0 +1,247 @@
+import io
+import posixpath
+import re
+import zipfile
+from xml.sax.saxutils import unescape
+from lxml import etree
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# Cells of column A in sheet XML, with their attributes and content (r is written on every cell by Excel and openpyxl)
+COLUMN_A_CELL_PATTERN = re.compile(rb'<(?:\w+:)?c\s([^>]*?\br="A(\d+)"[^>]*?)(?:/>|>(.*?)</(?:\w+:)?c>)', re.S)
+CELL_TYPE_PATTERN = re.compile(rb'\bt="(\w+)"')
+CELL_VALUE_PATTERN = re.compile(rb'<(?:\w+:)?v>([^<]*)</')
+INLINE_TEXT_PATTERN = re.compile(rb'<(?:\w+:)?t(?:\s[^>]*)?>([^<]*)</')
+MARKER_PREFIXES = ("pptstart:", "pptend:")
+SCAN_CHUNK_SIZE = 1024 * 1024
+
+
+def _workbook_part(xlsx_zip):
+    """Return the path of the workbook part from the package relationships."""
+    with xlsx_zip.open('_rels/.rels') as rels:
+        for _, element in etree.iterparse(rels, tag=f'{{{PKG_REL_NS}}}Relationship'):
+            if element.get('Type', '').endswith('/officeDocument'):
+                return element.get('Target').lstrip('/')
+    return 'xl/workbook.xml'
+
+
+def _active_sheet(xlsx_zip, workbook_part):
+    """Return the name and relationship id of the active sheet, reading workbook.xml up to </sheets>."""
+    active_tab = 0
+    sheets = []
+    with xlsx_zip.open(workbook_part) as workbook_xml:
+        for _, element in etree.iterparse(workbook_xml, tag=(f'{{{MAIN_NS}}}workbookView', f'{{{MAIN_NS}}}sheet', f'{{{MAIN_NS}}}sheets')):
+            if element.tag == f'{{{MAIN_NS}}}workbookView':
+                active_tab = int(element.get('activeTab', 0))
+            elif element.tag == f'{{{MAIN_NS}}}sheet':
+                sheets.append((element.get('name'), element.get(f'{{{REL_NS}}}id')))
+            else:
+                break
+    if not sheets:
+        return None
+    return sheets[active_tab] if active_tab < len(sheets) else sheets[0]
+
+
+def _workbook_sheets(xlsx_zip, workbook_part):
+    """Return the name and relationship id of every sheet, in workbook order."""
+    sheets = []
+    with xlsx_zip.open(workbook_part) as workbook_xml:
+        for _, element in etree.iterparse(workbook_xml, tag=(f'{{{MAIN_NS}}}sheet', f'{{{MAIN_NS}}}sheets')):
+            if element.tag == f'{{{MAIN_NS}}}sheets':
+                break
+            sheets.append((element.get('name'), element.get(f'{{{REL_NS}}}id')))
+    return sheets
+
+
+def _relationship_targets(xlsx_zip, part):
+    """Return the targets of the relationships of a part, by id and by type suffix."""
+    rels_name = posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+    by_id = {}
+    by_type = {}
+    with xlsx_zip.open(rels_name) as rels:
+        for _, element in etree.iterparse(rels, tag=f'{{{PKG_REL_NS}}}Relationship'):
+            target = element.get('Target')
+            if target.startswith('/'):
+                target = target.lstrip('/')
+            else:
+                target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+            by_id[element.get('Id')] = target
+            by_type[element.get('Type', '').rsplit('/', 1)[-1]] = target
+    return by_id, by_type
+
+
+def _shared_string(xlsx_zip, shared_strings_part, index):
+    """Return the shared string at index, reading sharedStrings.xml only up to that entry."""
+    position = 0
+    with xlsx_zip.open(shared_strings_part) as strings_xml:
+        for _, element in etree.iterparse(strings_xml, tag=f'{{{MAIN_NS}}}si'):
+            if position == index:
+                # Rich text strings are split in runs, only the <t> elements hold text (not the phonetic <rPh>)
+                return "".join(text.text or "" for text in element.iter(f'{{{MAIN_NS}}}t')
+                               if text.getparent().tag != f'{{{MAIN_NS}}}rPh')
+            position += 1
+            element.clear()
+    return None
+
+
+def read_active_sheet_a1(content):
+    """
+    Return the name of the active sheet of an .xlsx workbook and the value of its A1 cell,
+    without loading the workbook: workbook.xml, the sheet XML and sharedStrings.xml are parsed
+    incrementally and only until the needed element is found.
+    Numbers are returned as their text, empty A1 cells as None.
+    """
+    with zipfile.ZipFile(io.BytesIO(content)) as xlsx_zip:
+        workbook_part = _workbook_part(xlsx_zip)
+        active_sheet = _active_sheet(xlsx_zip, workbook_part)
+        if active_sheet is None:
+            return None, None
+        sheet_name, rel_id = active_sheet
+        by_id, by_type = _relationship_targets(xlsx_zip, workbook_part)
+
+        cell = None
+        with xlsx_zip.open(by_id[rel_id]) as sheet_xml:
+            for _, element in etree.iterparse(sheet_xml, tag=(f'{{{MAIN_NS}}}c', f'{{{MAIN_NS}}}row', f'{{{MAIN_NS}}}sheetData')):
+                if element.tag == f'{{{MAIN_NS}}}c':
+                    if element.get('r') == 'A1':
+                        cell = element
+                        break
+                else:
+                    break  # A1 is always the first cell of the first row, stop after that row
+
+            if cell is None:
+                return sheet_name, None
+
+            cell_type = cell.get('t')
+            if cell_type == 'inlineStr':
+                return sheet_name, "".join(text.text or "" for text in cell.iter(f'{{{MAIN_NS}}}t'))
+            value = cell.findtext(f'{{{MAIN_NS}}}v')
+            if value is None:
+                return sheet_name, None
+            if cell_type == 's':
+                if 'sharedStrings' not in by_type:
+                    return sheet_name, None
+                return sheet_name, _shared_string(xlsx_zip, by_type['sharedStrings'], int(value))
+            return sheet_name, value
+
+
+def _marker_strings(xlsx_zip, shared_strings_part):
+    """Return the shared strings that are pptstart:/pptend: markers, by index."""
+    markers = {}
+    with xlsx_zip.open(shared_strings_part) as strings_xml:
+        for index, (_, element) in enumerate(etree.iterparse(strings_xml, tag=f'{{{MAIN_NS}}}si')):
+            text = "".join(text.text or "" for text in element.iter(f'{{{MAIN_NS}}}t')
+                           if text.getparent().tag != f'{{{MAIN_NS}}}rPh')
+            if text.startswith(MARKER_PREFIXES):
+                markers[index] = text
+            element.clear()
+    return markers
+
+
+def _last_row_end(data):
+    """Offset just past the last </row> (or </x:row>) in data, no cell spans that point, or 0."""
+    position = len(data)
+    while True:
+        position = data.rfind(b'row>', 0, position)
+        if position < 1:
+            return 0
+        if data[position - 1:position] in (b'/', b':'):
+            return position + 4
+
+
+def _column_a_strings(sheet_xml, marker_strings):
+    """Yield (row, text) of the string cells of column A, scanning the sheet XML in chunks."""
+    pending = b""
+    while True:
+        chunk = sheet_xml.read(SCAN_CHUNK_SIZE)
+        data = pending + chunk
+        end = len(data) if not chunk else _last_row_end(data)
+        for cell in COLUMN_A_CELL_PATTERN.finditer(data, 0, end):
+            cell_type = CELL_TYPE_PATTERN.search(cell.group(1))
+            cell_type = cell_type.group(1) if cell_type else b'n'
+            content = cell.group(3) or b''
+            if cell_type == b's':
+                value = CELL_VALUE_PATTERN.search(content)
+                text = marker_strings.get(int(value.group(1))) if value else None
+            elif cell_type == b'str':
+                value = CELL_VALUE_PATTERN.search(content)
+                text = unescape(value.group(1).decode('utf-8')) if value else None
+            elif cell_type == b'inlineStr':
+                text = unescape(b"".join(INLINE_TEXT_PATTERN.findall(content)).decode('utf-8'))
+            else:
+                continue
+            if text is not None:
+                yield int(cell.group(2)), text
+        pending = data[end:]
+        if not chunk:
+            return
+
+
+def scan_workbook_markers(file):
+    """
+    Return the pptstart:/pptend: marker mapping of a workbook (path or binary file object) like
+    ppt_workbook_update.analyze_excel_markers, without loading it: only the cells of column A
+    are picked from the sheet XML, and only the shared strings that are markers are kept.
+    """
+    mapping = {}
+    with zipfile.ZipFile(file) as xlsx_zip:
+        workbook_part = _workbook_part(xlsx_zip)
+        by_id, by_type = _relationship_targets(xlsx_zip, workbook_part)
+        shared_strings_part = by_type.get('sharedStrings')
+        marker_strings = _marker_strings(xlsx_zip, shared_strings_part) if shared_strings_part in xlsx_zip.NameToInfo else {}
+
+        for sheet_name, rel_id in _workbook_sheets(xlsx_zip, workbook_part):
+            sheet_part = by_id.get(rel_id)
+            if sheet_part not in xlsx_zip.NameToInfo:
+                continue
+            start_row = None
+            end_row = None
+            with xlsx_zip.open(sheet_part) as sheet_xml:
+                for row_idx, cell_value in _column_a_strings(sheet_xml, marker_strings):
+                    if cell_value.startswith("pptstart:"):
+                        marker_name = cell_value.split(":")[1]
+                        start_row = row_idx
+                    elif cell_value.startswith("pptend:"):
+                        end_row = row_idx - 1
+
+                    if start_row and end_row:
+                        mapping[marker_name] = {
+                            "sheet_name": sheet_name,
+                            "start_row": start_row,
+                            "end_row": end_row
+                        }
+                        start_row = None
+                        end_row = None
+    return mapping
+
+
+def _sheet_dimension(xlsx_zip, sheet_part):
+    """Return the (last row, last column) of the <dimension> of a sheet, None when the sheet has none."""
+    with xlsx_zip.open(sheet_part) as sheet_xml:
+        for _, element in etree.iterparse(sheet_xml, events=('start',)):
+            if element.tag == f'{{{MAIN_NS}}}dimension':
+                last_cell = element.get('ref', '').split(':')[-1]
+                match = re.match(r'^\$?([A-Z]+)\$?(\d+)$', last_cell)
+                if match is None:
+                    return None
+                column = 0
+                for letter in match.group(1):
+                    column = column * 26 + ord(letter) - ord('A') + 1
+                return int(match.group(2)), column
+            if element.tag == f'{{{MAIN_NS}}}sheetData':
+                return None  # The dimension comes before the cells, there is none
+    return None
+
+
+def read_sheet_dimensions(file):
+    """
+    Return {sheet name: (last row, last column) or None} of a workbook (path or binary file object),
+    from the <dimension> at the top of each sheet, without reading the cells.
+    """
+    with zipfile.ZipFile(file) as xlsx_zip:
+        workbook_part = _workbook_part(xlsx_zip)
+        by_id, _ = _relationship_targets(xlsx_zip, workbook_part)
+        return {sheet_name: _sheet_dimension(xlsx_zip, by_id[rel_id]) if by_id.get(rel_id) in xlsx_zip.NameToInfo else None
+                for sheet_name, rel_id in _workbook_sheets(xlsx_zip, workbook_part)}